@@ -0,0 +1,113 @@
+"""
+IndustrialRAG - Embedding engine report
+
+Compares each EMBED_ENGINE against the torch fp32 baseline:
+    python bench_embed.py --n 2000 --queries 200 --threads 4
+
+Texts are chunks from the saved metadata store, or synthetic maintenance
+sentences when it is empty. Queries are short spans cut from random chunks.
+Quality is the overlap of each engine's top-k with the baseline's top-k for
+the same query, plus the cosine between its vectors and the baseline's.
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+from embedder import load_engine, ENGINES
+
+VS_DIR = Path(__file__).parent.parent / "vectorstore"
+
+
+def _corpus(n: int, seed: int = 0) -> list:
+    db = VS_DIR / "metadata.db"
+    if db.exists():
+        con   = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+        texts = [r[0] for r in con.execute("SELECT text FROM chunk_text ORDER BY RANDOM() LIMIT ?", (n,))]
+        con.close()
+        if texts:
+            return texts
+    rng     = np.random.default_rng(seed)
+    parts   = ["battery pack", "drive motor", "hydraulic pump", "cooling fan", "brake pad", "main fuse",
+               "wheel sensor", "control board", "air filter", "conveyor belt", "limit switch", "relay"]
+    faults  = ["overheats", "shows error E04", "makes a grinding noise", "does not start", "trips the breaker",
+               "leaks oil", "vibrates at speed", "loses pressure", "reads zero", "stops intermittently"]
+    actions = ["replace the", "inspect the", "clean the", "tighten the", "reset the", "lubricate the",
+               "check the wiring of the", "measure voltage at the", "recalibrate the", "test the"]
+    return [
+        " ".join(
+            f"If the {rng.choice(parts)} {rng.choice(faults)}, {rng.choice(actions)} {rng.choice(parts)}."
+            for _ in range(rng.integers(3, 12))
+        )
+        for _ in range(n)
+    ]
+
+
+def _queries(texts: list, nq: int, seed: int = 1) -> list:
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in rng.integers(0, len(texts), nq):
+        words = texts[i].split()
+        span  = int(rng.integers(6, 14))
+        start = int(rng.integers(0, max(1, len(words) - span)))
+        out.append(" ".join(words[start:start + span]))
+    return out
+
+
+def _run(engine, texts: list, queries: list):
+    engine.encode(texts[:64])                       # warm-up: allocations, kernels
+    t0   = time.perf_counter()
+    docs = np.asarray(engine.encode(texts), dtype="float32")
+    bulk = len(texts) / (time.perf_counter() - t0)
+    lat, qv = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        qv.append(engine.encode([q])[0])
+        lat.append((time.perf_counter() - t0) * 1000)
+    return docs, np.asarray(qv, dtype="float32"), bulk, np.array(lat)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model",      default="all-MiniLM-L6-v2")
+    ap.add_argument("--engines",    default=",".join(ENGINES))
+    ap.add_argument("--n",          type=int, default=2000)
+    ap.add_argument("--queries",    type=int, default=200)
+    ap.add_argument("--k",          type=int, default=8, help="matches _retrieve's 5 manual + 3 log chunks")
+    ap.add_argument("--threads",    type=int, default=0)
+    ap.add_argument("--batch-size", type=int, default=32)
+    args = ap.parse_args()
+
+    texts   = _corpus(args.n)
+    queries = _queries(texts, args.queries)
+    engines = ["torch"] + [e for e in args.engines.split(",") if e != "torch"]
+
+    print(f"model={args.model}  texts={len(texts)}  queries={len(queries)}  k={args.k}  "
+          f"threads={args.threads or 'default'}  batch={args.batch_size}\n")
+    print(f"{'engine':<12}{'load s':>8}{'texts/s':>9}{'q p50 ms':>10}{'q p95 ms':>10}"
+          f"{'cos mean':>10}{'cos min':>9}{'top-k':>7}")
+
+    base = None
+    for name in engines:
+        t0 = time.perf_counter()
+        try:
+            engine = load_engine(args.model, name, VS_DIR / "onnx", args.threads, args.batch_size)
+        except Exception as e:
+            print(f"{name:<12}skipped: {e}")
+            continue
+        load_s = time.perf_counter() - t0
+        docs, qv, bulk, lat = _run(engine, texts, queries)
+        top = np.argsort(-(qv @ docs.T), axis=1)[:, :args.k]
+        if base is None:
+            base = (docs, top)
+        cos     = np.sum(docs * base[0], axis=1)
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(top, base[1])])
+        print(f"{name:<12}{load_s:>8.1f}{bulk:>9.0f}{np.percentile(lat, 50):>10.1f}{np.percentile(lat, 95):>10.1f}"
+              f"{cos.mean():>10.4f}{cos.min():>9.4f}{overlap:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+IndustrialRAG - Index recall / latency report
+
+Compares each INDEX_TYPE against the exact flat baseline:
+    python bench_index.py --n 100000 --queries 500 --k 5
+
+Vectors are synthetic, clustered and L2-normalised to mimic sentence
+embeddings. Pass --store to benchmark the saved vectorstore's current
+snapshot instead: every index is built from its vectors and ids, and
+queries are sampled from them.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+import vector_index
+from segment_store import SegmentStore
+from vector_index import VectorIndex
+
+DIM = 384
+
+
+def _synthetic(n: int, seed: int = 0) -> np.ndarray:
+    # Topic clusters in a low-dimensional latent space, projected up to DIM —
+    # sentence embeddings have far lower intrinsic dimension than 384.
+    rng     = np.random.default_rng(seed)
+    latent  = 48
+    centres = rng.standard_normal((max(8, n // 500), latent))
+    labels  = rng.integers(0, len(centres), n)
+    points  = centres[labels] + 0.5 * rng.standard_normal((n, latent))
+    proj    = rng.standard_normal((latent, DIM))
+    vecs    = (points @ proj + 0.5 * rng.standard_normal((n, DIM))).astype("float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def _stored():
+    """(vectors, ids) of the saved vectorstore's current snapshot, all shards together."""
+    store = SegmentStore(Path(__file__).parent.parent / "vectorstore")
+    if not store.exists():
+        sys.exit(f"No saved index in {store.root} — upload documents first, or drop --store.")
+    _, si = store.open_snapshot(DIM)
+    parts = [shard.export() for shard in si.shards.values()]
+    if not parts or sum(len(ids) for _, ids in parts) == 0:
+        sys.exit(f"The saved index in {store.root} is empty — upload documents first, or drop --store.")
+    return np.vstack([v for v, _ in parts]), np.concatenate([ids for _, ids in parts])
+
+
+def _queries(base: np.ndarray, nq: int) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    q   = base[rng.integers(0, len(base), nq)] + 0.02 * rng.standard_normal((nq, DIM))
+    q   = q.astype("float32")
+    faiss.normalize_L2(q)
+    return q
+
+
+def _run(vi: VectorIndex, q: np.ndarray, k: int):
+    lat, found = [], []
+    for row in q:
+        t0 = time.perf_counter()
+        _, ids = vi.search(row[None, :], k)
+        lat.append((time.perf_counter() - t0) * 1000)
+        found.append(ids[0])
+    return np.array(found), np.array(lat)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n",       type=int, default=50000)
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--k",       type=int, default=5, help="a query takes the top 5 manual (3 log) chunks per shard")
+    ap.add_argument("--store",   action="store_true")
+    args = ap.parse_args()
+
+    faiss.omp_set_num_threads(1)          # per-query latency, as served
+    vector_index.IVF_TRAIN_MIN = 0        # train immediately for the report
+    if args.store:
+        base, ids = _stored()
+        base      = np.ascontiguousarray(base, dtype="float32")
+    else:
+        base = _synthetic(args.n)
+        ids  = np.arange(args.n, dtype="int64")
+    q = _queries(base, args.queries)
+
+    print(f"n={len(ids)}{' (store)' if args.store else ''}  queries={args.queries}  k={args.k}  dim={DIM}\n")
+    print(f"{'index':<26}{'build s':>9}{'recall@k':>10}{'p50 ms':>9}{'p95 ms':>9}{'MB':>8}")
+
+    truth = None
+    configs = [("flat", {}), ("hnsw", {"HNSW_EF_SEARCH": 64}), ("hnsw", {"HNSW_EF_SEARCH": 128}),
+               ("ivfpq", {"IVF_NPROBE": 16, "IVF_RERANK": 1}), ("ivfpq", {"IVF_NPROBE": 8, "IVF_RERANK": 8}),
+               ("ivfpq", {"IVF_NPROBE": 16, "IVF_RERANK": 8}), ("ivfpq", {"IVF_NPROBE": 48, "IVF_RERANK": 8})]
+    built = {}
+    for kind, params in configs:
+        if kind == "ivfpq" and len(ids) < 2 ** vector_index.PQ_NBITS:
+            print(f"ivfpq skipped: PQ training needs ≥ {2 ** vector_index.PQ_NBITS} vectors")
+            break
+        for name, val in params.items():
+            setattr(vector_index, name, val)
+        if kind not in built:
+            t0 = time.perf_counter()
+            vi = VectorIndex(DIM, kind)
+            vi.add(base, ids)
+            built[kind] = (vi, time.perf_counter() - t0)
+        vi, build_s = built[kind]
+        found, lat  = _run(vi, q, args.k)
+        if truth is None:
+            truth = found
+        recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+        size   = sum(len(faiss.serialize_index(x)) for x in (vi.index, vi.exact) if x is not None) / 1e6
+        label  = " ".join([kind] + [f"{p.split('_', 1)[1].lower()}={v}" for p, v in params.items()])
+        print(f"{label:<26}{build_s:>9.1f}{recall:>10.3f}{np.percentile(lat, 50):>9.2f}"
+              f"{np.percentile(lat, 95):>9.2f}{size:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
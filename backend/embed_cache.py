@@ -0,0 +1,145 @@
+"""
+IndustrialRAG - Embedding Cache
+Vectors keyed by (model name, hash of the normalised text). A bounded LRU in
+memory sits in front of a SQLite tier on disk, so repeated repair-log rows,
+boilerplate manual pages and common technician queries are encoded once —
+across uploads, queries and restarts.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+EMBED_CACHE_MEM  = int(os.environ.get("EMBED_CACHE_MEM", "20000"))     # vectors held in RAM
+EMBED_CACHE_DISK = int(os.environ.get("EMBED_CACHE_DISK", "200000"))   # vectors on disk, 0 = memory only
+
+
+def normalise(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Wraps an encode(texts) -> float32 array function. Safe to share across
+    threads; misses are encoded outside the lock, in one batch per call.
+    """
+
+    def __init__(self, path: Path, model_name: str, encode, dim: int,
+                 mem_items: int = None, disk_items: int = None):
+        self.model      = model_name
+        self.dim        = dim
+        self._encode    = encode
+        self.mem_items  = EMBED_CACHE_MEM if mem_items is None else mem_items
+        self.disk_items = EMBED_CACHE_DISK if disk_items is None else disk_items
+        self._mem       = OrderedDict()    # key → vector, least recently used first
+        self._lock      = threading.Lock()
+        self._stats     = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "encode_s": 0.0}
+        self._db        = None
+        self._disk_n    = 0
+        if self.disk_items > 0:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS vecs (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+            self._disk_n = self._db.execute("SELECT COUNT(*) FROM vecs").fetchone()[0]
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model}\0{normalise(text)}".encode("utf-8")).hexdigest()
+
+    def encode(self, texts: list) -> np.ndarray:
+        keys  = [self.key(t) for t in texts]
+        out   = [None] * len(texts)
+        with self._lock:
+            for i, k in enumerate(keys):
+                v = self._mem.get(k)
+                if v is not None:
+                    self._mem.move_to_end(k)
+                    out[i] = v
+                    self._stats["mem_hits"] += 1
+            if self._db is not None:
+                cold = list({k for k, v in zip(keys, out) if v is None})
+                found = {}
+                for j in range(0, len(cold), 500):
+                    batch = cold[j:j + 500]
+                    found.update(self._db.execute(
+                        f"SELECT key, vec FROM vecs WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall())
+                for i, k in enumerate(keys):
+                    if out[i] is None and k in found:
+                        out[i] = np.frombuffer(found[k], dtype="float32")
+                        self._remember(k, out[i])
+                        self._stats["disk_hits"] += 1
+
+        # Encode each distinct missing text once
+        todo = {}
+        for i, k in enumerate(keys):
+            if out[i] is None:
+                todo.setdefault(k, []).append(i)
+        if todo:
+            t0   = time.perf_counter()
+            vecs = np.asarray(self._encode([texts[ix[0]] for ix in todo.values()]), dtype="float32")
+            took = time.perf_counter() - t0
+            with self._lock:
+                self._stats["misses"]   += len(todo)
+                self._stats["mem_hits"] += len(keys) - len(todo) - sum(o is not None for o in out)  # repeats within the batch
+                self._stats["encode_s"] += took
+                for (k, ix), v in zip(todo.items(), vecs):
+                    for i in ix:
+                        out[i] = v
+                    self._remember(k, v)
+                if self._db is not None:
+                    with self._db:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO vecs VALUES (?,?)",
+                            [(k, v.tobytes()) for k, v in zip(todo, vecs)],
+                        )
+                        self._disk_n += len(todo)
+                        self._trim_disk()
+        if not texts:
+            return np.zeros((0, self.dim), dtype="float32")
+        return np.vstack(out)
+
+    def _remember(self, key: str, vec):
+        """Caller holds the lock."""
+        if self.mem_items <= 0:
+            return
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def _trim_disk(self):
+        """Drop the oldest-written vectors once the disk tier is full. Caller holds the lock."""
+        if self._disk_n > self.disk_items:
+            self._db.execute(
+                "DELETE FROM vecs WHERE rowid IN (SELECT rowid FROM vecs ORDER BY rowid LIMIT ?)",
+                (self._disk_n - self.disk_items,),
+            )
+            self._disk_n = self._db.execute("SELECT COUNT(*) FROM vecs").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["mem_items"]  = len(self._mem)
+            s["disk_items"] = self._disk_n
+        lookups = s["mem_hits"] + s["disk_hits"] + s["misses"]
+        per_vec = s["encode_s"] / s["misses"] if s["misses"] else 0.0
+        return {
+            "model":           self.model,
+            "lookups":         lookups,
+            "mem_hits":        s["mem_hits"],
+            "disk_hits":       s["disk_hits"],
+            "misses":          s["misses"],
+            "hit_rate":        round((s["mem_hits"] + s["disk_hits"]) / lookups, 3) if lookups else 0.0,
+            "mem_items":       s["mem_items"],
+            "disk_items":      s["disk_items"],
+            "encode_s":        round(s["encode_s"], 2),
+            "est_saved_s":     round((s["mem_hits"] + s["disk_hits"]) * per_vec, 2),
+        }
@@ -0,0 +1,157 @@
+"""
+IndustrialRAG - Embedding Engines
+The sentence-transformers model behind one encode(texts) interface, on a
+choice of CPU runtimes. Every engine mean-pools and L2-normalises into the
+same vector space, so an index built with one is searchable with another;
+int8 engines trade a little precision for speed.
+
+    torch       SentenceTransformer on PyTorch (default)
+    torch-int8  same, Linear layers dynamically quantised to int8
+    onnx        ONNX Runtime, model exported once into the cache directory
+    onnx-int8   ONNX Runtime, exported model dynamically quantised to int8
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+EMBED_ENGINE     = os.environ.get("EMBED_ENGINE", "torch")
+EMBED_THREADS    = int(os.environ.get("EMBED_THREADS", "0"))        # intra-op threads, 0 = runtime default
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))    # texts per forward pass
+
+ENGINES = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+def embedding_id(model_name: str, engine: str = None) -> str:
+    """Cache key prefix: fp32 engines give the same vectors; each int8 engine quantises its own way."""
+    engine = engine or EMBED_ENGINE
+    return f"{model_name}+{engine}" if engine.endswith("-int8") else model_name
+
+
+def load_engine(model_name: str, engine: str = None, cache_dir: Path = None,
+                threads: int = None, batch_size: int = None):
+    engine     = engine or EMBED_ENGINE
+    threads    = EMBED_THREADS if threads is None else threads
+    batch_size = EMBED_BATCH_SIZE if batch_size is None else batch_size
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown EMBED_ENGINE '{engine}', expected one of {', '.join(ENGINES)}")
+    if engine.startswith("onnx"):
+        if cache_dir is None:
+            raise ValueError("ONNX engines need a cache_dir for the exported model")
+        return OnnxEngine(model_name, engine == "onnx-int8", threads, batch_size, cache_dir)
+    return TorchEngine(model_name, engine == "torch-int8", threads, batch_size)
+
+
+class TorchEngine:
+    def __init__(self, model_name: str, quantize: bool, threads: int, batch_size: int):
+        from sentence_transformers import SentenceTransformer
+        self.name       = "torch-int8" if quantize else "torch"
+        self.batch_size = batch_size
+        self.model      = SentenceTransformer(model_name, device="cpu")
+        self.dim        = self.model.get_sentence_embedding_dimension()
+        if threads or quantize:
+            import torch
+            if threads:
+                torch.set_num_threads(threads)
+            if quantize:
+                self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def encode(self, texts: list) -> np.ndarray:
+        return self.model.encode(
+            texts, batch_size=self.batch_size, show_progress_bar=False, normalize_embeddings=True,
+        )
+
+
+class OnnxEngine:
+    def __init__(self, model_name: str, quantize: bool, threads: int, batch_size: int, cache_dir: Path):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        export = _export(model_name, Path(cache_dir))
+        path   = _quantised(export) if quantize else export / "model.onnx"
+        info   = json.loads((export / "engine.json").read_text())
+        opts   = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.name       = "onnx-int8" if quantize else "onnx"
+        self.batch_size = batch_size
+        self.dim        = info["dim"]
+        self.max_len    = info["max_seq_length"]
+        self.session    = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+        self.inputs     = {i.name for i in self.session.get_inputs()}
+        self.tokenizer  = AutoTokenizer.from_pretrained(str(export))
+
+    def encode(self, texts: list) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        # Batch similar lengths together to keep padding down, as SentenceTransformer does
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        for b in range(0, len(order), self.batch_size):
+            rows   = order[b:b + self.batch_size]
+            tok    = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                    max_length=self.max_len, return_tensors="np")
+            feed   = {k: v.astype("int64") for k, v in tok.items() if k in self.inputs}
+            hidden = self.session.run(None, feed)[0]
+            mask   = tok["attention_mask"][..., None].astype("float32")
+            vecs   = (hidden * mask).sum(1) / np.clip(mask.sum(1), 1e-9, None)
+            out[rows] = vecs / np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        return out
+
+
+def _export(model_name: str, cache_dir: Path) -> Path:
+    """
+    Transformer body → cache_dir/<model>/model.onnx plus its tokenizer, once.
+    Pooling and normalisation run in numpy, so only mean-pooled models qualify.
+    """
+    out = cache_dir / model_name.replace("/", "__")
+    if (out / "engine.json").exists():
+        return out
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    st      = SentenceTransformer(model_name, device="cpu")
+    pooling = st[1]
+    if not getattr(pooling, "pooling_mode_mean_tokens", False) or len(st) > 3:
+        raise ValueError(f"ONNX engine supports mean-pooled models only; '{model_name}' is not one")
+
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids")
+             if n in st.tokenizer("export", return_tensors="pt")]
+    dummy = st.tokenizer(["export", "a longer export sentence"], padding=True, return_tensors="pt")
+
+    class _Body(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(names, args))).last_hidden_state
+
+    tmp = cache_dir / f".{out.name}.{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    axes = {n: {0: "batch", 1: "seq"} for n in names}
+    torch.onnx.export(
+        _Body(st[0].auto_model).eval(), tuple(dummy[n] for n in names), str(tmp / "model.onnx"),
+        input_names=names, output_names=["last_hidden_state"],
+        dynamic_axes=dict(axes, last_hidden_state={0: "batch", 1: "seq"}), opset_version=14,
+    )
+    st.tokenizer.save_pretrained(str(tmp))
+    (tmp / "engine.json").write_text(json.dumps({
+        "model": model_name, "dim": st.get_sentence_embedding_dimension(), "max_seq_length": st.max_seq_length,
+    }))
+    try:
+        tmp.rename(out)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)      # another process exported it first
+    return out
+
+
+def _quantised(export: Path) -> Path:
+    path = export / "model.int8.onnx"
+    if not path.exists():
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp = export / f".model.int8.{os.getpid()}.onnx"
+        quantize_dynamic(str(export / "model.onnx"), str(tmp), weight_type=QuantType.QInt8)
+        os.replace(tmp, path)
+    return path
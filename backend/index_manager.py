@@ -0,0 +1,60 @@
+"""
+IndustrialRAG - Versioned Index
+Queries search an immutable version of the ShardedIndex and never take a
+lock. Writers are serialised: each works on a fork of the current version
+(shards are copied only when first changed) and publishes it as the next
+version when done. A query therefore never waits for an ingestion, a
+checkpoint or a reset, and never sees one half-applied.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class IndexManager:
+    def __init__(self, on_publish=None):
+        self.version     = 0
+        self._current    = None          # published ShardedIndex, never modified again
+        self._draft      = None          # the open write's fork
+        self._lock       = threading.RLock()
+        self._on_publish = on_publish    # called after every publish, still inside the write
+
+    def snapshot(self):
+        """The current version to search, or None before the first publish. Hold on to it for a whole query."""
+        return self._current
+
+    @contextmanager
+    def write(self):
+        """
+        Serialise with other writers and yield a fork to change, published on
+        exit — also after an error, since the WAL already holds whatever was
+        applied. A nested write() joins the enclosing one.
+        """
+        with self._lock:
+            if self._draft is not None:
+                yield self._draft
+                return
+            self._draft = self._current.fork()
+            try:
+                yield self._draft
+            finally:
+                draft, self._draft = self._draft, None
+                self._swap(draft)
+
+    def publish(self, index):
+        """
+        Replace the whole index: on open, reset, or a new generation from the
+        writer process. Inside a write() it replaces that write's fork, so
+        re-enter write() to keep changing it.
+        """
+        with self._lock:
+            if self._draft is not None:
+                self._draft = index
+            else:
+                self._swap(index)
+
+    def _swap(self, index):
+        self._current  = index
+        self.version  += 1
+        if self._on_publish:
+            self._on_publish(self.version)
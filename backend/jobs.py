@@ -0,0 +1,187 @@
+"""
+IndustrialRAG - Ingestion Jobs
+Uploads are queued as jobs and processed in the background. Job records live
+in SQLite, so queued or interrupted jobs are picked up again after a restart.
+Live progress is kept in memory and written through on every state change.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+ACTIVE = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    machine_name TEXT NOT NULL,
+    filename     TEXT NOT NULL,
+    staged       TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    created      REAL NOT NULL,
+    state        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs(status);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """One upload being ingested. Workers report progress; readers call to_dict()."""
+
+    def __init__(self, id, kind, machine_name, filename, staged, status="queued", created=None, **state):
+        self.id               = id
+        self.kind             = kind
+        self.machine_name     = machine_name
+        self.filename         = filename
+        self.staged           = staged
+        self.status           = status
+        self.created          = created or time.time()
+        self.started          = state.get("started")
+        self.finished         = state.get("finished")
+        self.pages_total      = state.get("pages_total", 0)
+        self.pages_done       = state.get("pages_done", 0)
+        self.chunks_total     = state.get("chunks_total", 0)
+        self.chunks_embedded  = state.get("chunks_embedded", 0)
+        self.embed_started    = state.get("embed_started")
+        self.error            = state.get("error")
+        self.error_status     = state.get("error_status")
+        self.result           = state.get("result")
+        self.cancel_requested = state.get("cancel_requested", False)
+
+    # ── Worker side ──
+    def progress(self, **counters):
+        if "chunks_total" in counters and self.embed_started is None:
+            self.embed_started = time.time()
+        for k, v in counters.items():
+            setattr(self, k, v)
+
+    def check(self):
+        """Called between pages / batches; aborts the job if a cancel was requested."""
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def _state(self) -> dict:
+        keys = ("started", "finished", "pages_total", "pages_done", "chunks_total",
+                "chunks_embedded", "embed_started", "error", "error_status", "result",
+                "cancel_requested")
+        return {k: getattr(self, k) for k in keys}
+
+    # ── Reader side ──
+    def to_dict(self) -> dict:
+        now     = self.finished or time.time()
+        elapsed = (now - self.started) if self.started else 0.0
+        pps     = self.pages_done / elapsed if elapsed > 0 else 0.0
+        cps     = 0.0
+        if self.embed_started and self.chunks_embedded:
+            cps = self.chunks_embedded / max(now - self.embed_started, 1e-6)
+
+        # Embedding runs alongside reading and keeps up with it, so while
+        # pages are left the page rate is the rate of the whole pipeline
+        eta = None
+        if self.status == "running":
+            if self.pages_done < self.pages_total and pps > 0:
+                eta = (self.pages_total - self.pages_done) / pps
+            elif cps > 0:
+                eta = (self.chunks_total - self.chunks_embedded) / cps
+
+        return {
+            "job_id":          self.id,
+            "kind":            self.kind,
+            "machine":         self.machine_name,
+            "filename":        self.filename,
+            "status":          self.status,
+            "pages_total":     self.pages_total,
+            "pages_done":      self.pages_done,
+            "chunks_total":    self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "elapsed_s":       round(elapsed, 1),
+            "pages_per_s":     round(pps, 2),
+            "chunks_per_s":    round(cps, 1),
+            "eta_s":           None if eta is None else round(eta, 1),
+            "error":           self.error,
+            "result":          self.result,
+        }
+
+
+class JobStore:
+    """Persistent job table plus the live Job objects of this process."""
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._live = {}
+
+    def create(self, kind: str, machine_name: str, filename: str, staged: Path) -> Job:
+        job = Job(uuid.uuid4().hex[:12], kind, machine_name, filename, str(staged))
+        self.save(job)
+        return job
+
+    def save(self, job: Job):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?,?,?,?,?,?,?,?)",
+                (job.id, job.kind, job.machine_name, job.filename, job.staged,
+                 job.status, job.created, json.dumps(job._state())),
+            )
+            self._live[job.id] = job
+
+    def get(self, job_id: str):
+        with self._lock:
+            if job_id in self._live:
+                return self._live[job_id]
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _from_row(row) if row else None
+
+    def recent(self, limit: int = 50) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+            return [self._live.get(r[0]) or _from_row(r) for r in rows]
+
+    def pending(self) -> list:
+        """Jobs that were queued or mid-run when the process last stopped, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE))}) ORDER BY created",
+                ACTIVE,
+            ).fetchall()
+        jobs = []
+        for r in rows:
+            job = _from_row(r)
+            job.status = "queued"
+            job.pages_done = job.chunks_embedded = 0
+            jobs.append(job)
+        return jobs
+
+    # ── Transitions ──
+    def start(self, job: Job):
+        job.status, job.started = "running", time.time()
+        self.save(job)
+
+    def finish(self, job: Job, status: str, error: str = None, error_status: int = None):
+        job.status, job.finished = status, time.time()
+        job.error, job.error_status = error, error_status
+        self.save(job)
+
+    def cancel(self, job: Job):
+        job.cancel_requested = True
+        if job.status == "queued":
+            self.finish(job, "cancelled")
+        else:
+            self.save(job)
+
+
+def _from_row(row) -> Job:
+    id_, kind, machine_name, filename, staged, status, created, state = row
+    return Job(id_, kind, machine_name, filename, staged, status, created, **json.loads(state))
@@ -0,0 +1,192 @@
+"""
+IndustrialRAG - LLM Answer Cache
+Formatted answers keyed by a hash of (system prompt, context, query, backend
+chain). Memory LRU in front of SQLite, both with a TTL. Concurrent identical
+requests are single-flighted: one generation, every caller gets its result.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "500"))       # answers held in RAM, 0 = no cache
+LLM_CACHE_DISK = int(os.environ.get("LLM_CACHE_DISK", "20000"))     # answers on disk, 0 = memory only
+LLM_CACHE_TTL  = float(os.environ.get("LLM_CACHE_TTL", "86400"))    # seconds
+
+
+def answer_key(*parts: str) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class AnswerCache:
+    """Safe to share across threads."""
+
+    def __init__(self, path: Path, size: int = None, disk: int = None, ttl: float = None):
+        self.size      = LLM_CACHE_SIZE if size is None else size
+        self.disk      = LLM_CACHE_DISK if disk is None else disk
+        self.ttl       = LLM_CACHE_TTL if ttl is None else ttl
+        self._mem      = OrderedDict()      # key → (answer, created)
+        self._inflight = {}                 # key → Future of the generation in progress
+        self._tasks    = set()              # detached async generations, see aget_or_generate()
+        self._lock     = threading.Lock()
+        self._stats    = {"hits": 0, "disk_hits": 0, "shared": 0, "misses": 0}
+        self._db       = None
+        if self.size > 0 and self.disk > 0:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, created REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS ix_answers_created ON answers(created);"
+            )
+            with self._db:
+                self._db.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+
+    def get(self, key: str):
+        if self.size <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._mem.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+            if entry:
+                del self._mem[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT answer, created FROM answers WHERE key = ? AND created >= ?", (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    self._remember(key, row[0], row[1])
+                    self._stats["disk_hits"] += 1
+                    return row[0]
+        return None
+
+    def put(self, key: str, answer: str):
+        if self.size <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, answer, now)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO answers VALUES (?,?,?)", (key, answer, now))
+                    self._db.execute(
+                        "DELETE FROM answers WHERE key IN "
+                        "(SELECT key FROM answers ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.disk,)
+                    )
+
+    def get_or_generate(self, key: str, generate, cacheable=lambda answer: True) -> str:
+        """
+        Cached answer, or run generate() once for all concurrent callers with
+        this key. Only answers passing cacheable() are stored.
+        """
+        while True:
+            answer, fut, leader = self._claim(key)
+            if fut is None:
+                return answer
+            if leader:
+                break
+            try:
+                return fut.result()
+            except BaseException:
+                if not fut.cancelled():
+                    raise
+                # an async generation was abandoned: claim the key again
+        try:
+            answer = generate()
+        except BaseException as e:
+            self._settle(key, fut, error=e)
+            raise
+        self._settle(key, fut, answer, cacheable=cacheable)
+        return answer
+
+    async def aget_or_generate(self, key: str, agenerate, cacheable=lambda answer: True) -> str:
+        """
+        get_or_generate for coroutines; shares in-flight generations with sync
+        callers too. The generation runs as a task of its own, so a caller
+        that is cancelled (its client went away) stops waiting without
+        failing the others.
+        """
+        while True:
+            answer, fut, leader = self._claim(key)
+            if fut is None:
+                return answer
+            if leader:
+                task = asyncio.ensure_future(self._agenerate(key, fut, agenerate, cacheable))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            try:
+                return await asyncio.shield(asyncio.wrap_future(fut))
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise           # this caller was cancelled, the generation carries on
+                # the generation itself was cancelled: claim the key again
+
+    async def _agenerate(self, key: str, fut: Future, agenerate, cacheable):
+        try:
+            answer = await agenerate()
+        except asyncio.CancelledError:
+            # No error for the waiters: they find the key free and one of them generates
+            with self._lock:
+                self._inflight.pop(key, None)
+            fut.cancel()
+            raise
+        except Exception as e:
+            self._settle(key, fut, error=e)
+            return
+        self._settle(key, fut, answer, cacheable=cacheable)
+
+    def _claim(self, key: str):
+        """(cached answer, None, False), or (None, in-flight future, whether we must generate)."""
+        answer = self.get(key)
+        if answer is not None:
+            return answer, None, False
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self._stats["shared"] += 1
+                return None, fut, False
+            entry = self._mem.get(key)       # a leader may have finished since get()
+            if entry and time.time() - entry[1] < self.ttl:
+                self._stats["hits"] += 1
+                return entry[0], None, False
+            self._stats["misses"] += 1
+            fut = self._inflight[key] = Future()
+            return None, fut, True
+
+    def _settle(self, key: str, fut: Future, answer=None, error=None, cacheable=None):
+        if error is None and cacheable(answer):
+            self.put(key, answer)
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is None:
+            fut.set_result(answer)
+        else:
+            fut.set_exception(error)
+
+    def _remember(self, key: str, answer: str, created: float):
+        """Caller holds the lock."""
+        self._mem[key] = (answer, created)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.size:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats, entries=len(self._mem), inflight=len(self._inflight))
+        lookups = s["hits"] + s["disk_hits"] + s["shared"] + s["misses"]
+        s["hit_rate"] = round((lookups - s["misses"]) / lookups, 3) if lookups else 0.0
+        return s
@@ -0,0 +1,87 @@
+"""
+IndustrialRAG - LLM Client Pool
+One long-lived async client per backend (keep-alive connections reused across
+requests) plus a per-backend cap on in-flight generations, so many technicians
+can wait on answers without holding a worker thread each.
+"""
+
+import asyncio
+import os
+import threading
+
+OLLAMA_URL          = "http://localhost:11434"
+LLM_TIMEOUT         = float(os.environ.get("LLM_TIMEOUT", "120"))
+LLM_POOL_SIZE       = int(os.environ.get("LLM_POOL_SIZE", "20"))          # keep-alive connections per backend
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))     # in-flight generations per backend
+
+
+class ClientPool:
+    """
+    Clients and semaphores are bound to the event loop they are first used
+    in, so each loop (the API's, or one asyncio.run from a script or worker
+    thread) gets its own set. A short-lived loop must `await aclose()` before
+    it ends, or its connections are left open.
+    """
+
+    def __init__(self):
+        self._loops = {}        # loop → (clients, slots)
+        self._lock  = threading.Lock()
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._loops:
+                for old in [l for l in self._loops if l.is_closed()]:
+                    if self._loops.pop(old)[0]:
+                        print("WARNING: LLM clients of a closed event loop were never closed")
+                self._loops[loop] = ({}, {})
+            return self._loops[loop]
+
+    def slot(self, backend: str) -> asyncio.Semaphore:
+        _, slots = self._check_loop()
+        if backend not in slots:
+            slots[backend] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        return slots[backend]
+
+    def ollama(self):
+        import httpx
+        clients, _ = self._check_loop()
+        if "ollama" not in clients:
+            clients["ollama"] = httpx.AsyncClient(
+                base_url=OLLAMA_URL,
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+            )
+        return clients["ollama"]
+
+    def openai(self):
+        from openai import AsyncOpenAI
+        clients, _ = self._check_loop()
+        if "openai" not in clients:
+            clients["openai"] = AsyncOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY"), timeout=LLM_TIMEOUT,
+            )
+        return clients["openai"]
+
+    def anthropic(self):
+        import anthropic
+        clients, _ = self._check_loop()
+        if "anthropic" not in clients:
+            clients["anthropic"] = anthropic.AsyncAnthropic(
+                api_key=os.environ.get("ANTHROPIC_API_KEY"), timeout=LLM_TIMEOUT,
+            )
+        return clients["anthropic"]
+
+    async def aclose(self):
+        """Close the running loop's clients."""
+        with self._lock:
+            clients, _ = self._loops.pop(asyncio.get_running_loop(), ({}, {}))
+        for client in clients.values():
+            close = getattr(client, "aclose", None) or getattr(client, "close")
+            try:
+                await close()
+            except Exception:
+                pass
+
+
+pool = ClientPool()
@@ -4,8 +4,22 @@ Strict grounding: only outputs what is in the retrieved context.
 """
 
 import os
+import json
+import time
+import asyncio
+from pathlib import Path
 from typing import Optional
 
+from llm_cache import AnswerCache, answer_key
+from llm_clients import pool
+from llm_scheduler import scheduler
+
+OPENAI_MODEL    = "gpt-4o-mini"
+ANTHROPIC_MODEL = "claude-haiku-4-5-20251001"
+
+# Identical (context, query) pairs — e.g. Streamlit re-renders — reuse the answer
+_cache = AnswerCache(Path(__file__).parent.parent / "vectorstore" / "llm_cache.db")
+
 SYSTEM_PROMPT = """You are an industrial maintenance assistant. Your ONLY job is to extract and structure information from the provided CONTEXT.
 
 STRICT RULES:
@@ -43,20 +57,20 @@ def _is_bad(text: str) -> bool:
     return not text or "INSUFFICIENT_CONTEXT" in text.upper()
 
 
-def _ollama(context: str, query: str) -> Optional[str]:
+def _ollama_payload(context: str, query: str, stream: bool) -> dict:
+    return {
+        "model":   os.environ.get("OLLAMA_MODEL", "mistral"),
+        "prompt":  _prompt(context, query),
+        "system":  SYSTEM_PROMPT,
+        "stream":  stream,
+        "options": {"temperature": 0.0, "num_predict": 1024},
+    }
+
+
+async def _ollama(context: str, query: str) -> Optional[str]:
     try:
-        import requests
-        r = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model":   os.environ.get("OLLAMA_MODEL", "mistral"),
-                "prompt":  _prompt(context, query),
-                "system":  SYSTEM_PROMPT,
-                "stream":  False,
-                "options": {"temperature": 0.0, "num_predict": 1024},
-            },
-            timeout=120,
-        )
+        async with pool.slot("ollama"):
+            r = await pool.ollama().post("/api/generate", json=_ollama_payload(context, query, stream=False))
         if r.status_code == 200:
             return r.json().get("response", "")
     except Exception as e:
@@ -64,41 +78,85 @@ def _ollama(context: str, query: str) -> Optional[str]:
     return None
 
 
-def _openai(context: str, query: str) -> Optional[str]:
+async def _ollama_stream(context: str, query: str):
+    async with pool.slot("ollama"):
+        async with pool.ollama().stream(
+            "POST", "/api/generate", json=_ollama_payload(context, query, stream=True),
+        ) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                part = json.loads(line)
+                if part.get("response"):
+                    yield part["response"]
+                if part.get("done"):
+                    break
+
+
+def _messages(context: str, query: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user",   "content": _prompt(context, query)},
+    ]
+
+
+async def _openai(context: str, query: str) -> Optional[str]:
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        r = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user",   "content": _prompt(context, query)},
-            ],
-            temperature=0.0,
-            max_tokens=1024,
-        )
+        async with pool.slot("openai"):
+            r = await pool.openai().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=_messages(context, query),
+                temperature=0.0,
+                max_tokens=1024,
+            )
         return r.choices[0].message.content
     except Exception as e:
         print(f"OpenAI error: {e}")
     return None
 
 
-def _anthropic(context: str, query: str) -> Optional[str]:
-    try:
-        import anthropic
-        client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-        msg = client.messages.create(
-            model="claude-haiku-4-5-20251001",
+async def _openai_stream(context: str, query: str):
+    async with pool.slot("openai"):
+        stream = await pool.openai().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=_messages(context, query),
+            temperature=0.0,
             max_tokens=1024,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": _prompt(context, query)}],
+            stream=True,
         )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+async def _anthropic(context: str, query: str) -> Optional[str]:
+    try:
+        async with pool.slot("anthropic"):
+            msg = await pool.anthropic().messages.create(
+                model=ANTHROPIC_MODEL,
+                max_tokens=1024,
+                system=SYSTEM_PROMPT,
+                messages=[{"role": "user", "content": _prompt(context, query)}],
+            )
         return msg.content[0].text
     except Exception as e:
         print(f"Anthropic error: {e}")
     return None
 
 
+async def _anthropic_stream(context: str, query: str):
+    async with pool.slot("anthropic"):
+        async with pool.anthropic().messages.stream(
+            model=ANTHROPIC_MODEL,
+            max_tokens=1024,
+            system=SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": _prompt(context, query)}],
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+
 def _rule_based(context: str, query: str) -> str:
     """
     No-LLM fallback.
@@ -161,44 +219,180 @@ def _rule_based(context: str, query: str) -> str:
     return out
 
 
-def generate_formatted_response(context: str, query: str, machine: str) -> str:
+async def agenerate_formatted_response(context: str, query: str, machine: str) -> str:
     """
     Main entry point.
-    Priority: Ollama → OpenAI → Anthropic → rule-based fallback.
+    Priority: Ollama → OpenAI → Anthropic → rule-based fallback. A slow
+    backend is hedged with the next one; backends that keep failing are
+    skipped until their breaker cools down (see llm_scheduler).
     All paths are strictly grounded — no hallucination.
     """
     if not context.strip():
-        return (
-            "PROBLEM SUMMARY:\n"
-            f'No relevant content retrieved from the manual for "{query}" on {machine}.\n\n'
-            "POSSIBLE CAUSES:\n"
-            "1. Not found in manual.\n\n"
-            "STEP-BY-STEP CORRECTIVE ACTIONS:\n"
-            "1. Verify the correct manual has been uploaded in the Admin panel.\n"
-            "2. Ensure the machine name matches exactly what was used during upload.\n"
-            "3. Try rephrasing using terms from the manual.\n\n"
-            "SAFETY NOTES:\n"
-            "Do not attempt repairs without the official manual."
-        )
+        return _no_context(query, machine)
 
     result = None
+    chain  = _backends()
+    if chain:
+        result = await _cache.aget_or_generate(
+            _key(chain, context, query), lambda: _first_good(chain, context, query),
+            cacheable=lambda r: r is not None,
+        )
 
+    if not result:
+        result = _rule_based(context, query)
+
+    return result
+
+
+def generate_formatted_response(context: str, query: str, machine: str) -> str:
+    """Blocking wrapper for scripts and worker threads; the API awaits agenerate_formatted_response."""
+    async def run():
+        try:
+            return await agenerate_formatted_response(context, query, machine)
+        finally:
+            await pool.aclose()     # this loop ends here, and its connections with it
+    return asyncio.run(run())
+
+
+def _no_context(query: str, machine: str) -> str:
+    return (
+        "PROBLEM SUMMARY:\n"
+        f'No relevant content retrieved from the manual for "{query}" on {machine}.\n\n'
+        "POSSIBLE CAUSES:\n"
+        "1. Not found in manual.\n\n"
+        "STEP-BY-STEP CORRECTIVE ACTIONS:\n"
+        "1. Verify the correct manual has been uploaded in the Admin panel.\n"
+        "2. Ensure the machine name matches exactly what was used during upload.\n"
+        "3. Try rephrasing using terms from the manual.\n\n"
+        "SAFETY NOTES:\n"
+        "Do not attempt repairs without the official manual."
+    )
+
+
+def _backends() -> list:
+    """[(name, call, stream)] of the LLMs to try, in priority order. The names are part of the cache key."""
+    chain = []
     if os.environ.get("USE_OLLAMA", "true").lower() == "true":
-        result = _ollama(context, query)
-        if _is_bad(result):
-            result = None
+        chain.append((f"ollama:{os.environ.get('OLLAMA_MODEL', 'mistral')}", _ollama, _ollama_stream))
+    if os.environ.get("OPENAI_API_KEY"):
+        chain.append((f"openai:{OPENAI_MODEL}", _openai, _openai_stream))
+    if os.environ.get("ANTHROPIC_API_KEY"):
+        chain.append((f"anthropic:{ANTHROPIC_MODEL}", _anthropic, _anthropic_stream))
+    return chain
 
-    if not result and os.environ.get("OPENAI_API_KEY"):
-        result = _openai(context, query)
-        if _is_bad(result):
-            result = None
 
-    if not result and os.environ.get("ANTHROPIC_API_KEY"):
-        result = _anthropic(context, query)
-        if _is_bad(result):
-            result = None
+def _key(chain: list, context: str, query: str) -> str:
+    return answer_key(SYSTEM_PROMPT, context, query, "|".join(name for name, _, _ in chain))
 
-    if not result:
-        result = _rule_based(context, query)
 
+async def _first_good(chain: list, context: str, query: str) -> Optional[str]:
+    _, result = await scheduler.race(
+        chain, lambda backend: backend[1](context, query), good=lambda r: not _is_bad(r),
+    )
     return result
+
+
+# Tokens are held back until this much text has arrived, so an
+# INSUFFICIENT_CONTEXT reply is caught before anything reaches the user.
+_GUARD_CHARS = 40
+
+
+async def _open_stream(name: str, stream, context: str, query: str):
+    """
+    Read a backend's stream up to the grounding guard. Returns (text so far,
+    live generator), (text, None) if the reply is ungrounded, or None on error.
+    """
+    agen, text = stream(context, query), ""
+    try:
+        async for piece in agen:
+            text += piece
+            if _is_bad(text) or len(text) >= _GUARD_CHARS:
+                break
+    except Exception as e:
+        print(f"{name} stream error: {e}")
+        await agen.aclose()
+        return None
+    except BaseException:
+        await agen.aclose()                  # lost the race
+        raise
+    if _is_bad(text):
+        await agen.aclose()
+        return text, None
+    return text, agen
+
+
+async def _close_stream(opened):
+    if opened[1] is not None:
+        await opened[1].aclose()
+
+
+async def stream_formatted_response(context: str, query: str, machine: str):
+    """
+    Streaming variant of generate_formatted_response — same priority, hedging,
+    grounding check, cache and rule-based fallback. Backends race to the first
+    grounded tokens; the winner streams the rest. Yields events:
+        {"type": "token", "text": ...}      as the LLM generates
+        {"type": "reset"}                   a backend failed mid-answer; discard tokens so far
+        {"type": "done", "formatted": ..., "backend": ..., "ttft_ms": ..., "total_ms": ...}
+    """
+    t0 = time.perf_counter()
+
+    def done(text, backend, ttft):
+        return {"type": "done", "formatted": text, "backend": backend,
+                "ttft_ms": round(ttft * 1000), "total_ms": round((time.perf_counter() - t0) * 1000)}
+
+    if not context.strip():
+        text = _no_context(query, machine)
+        yield {"type": "token", "text": text}
+        yield done(text, "none", time.perf_counter() - t0)
+        return
+
+    chain = _backends()
+    key   = _key(chain, context, query) if chain else None
+    text  = _cache.get(key) if key else None
+    if text is not None:
+        yield {"type": "token", "text": text}
+        yield done(text, "cache", time.perf_counter() - t0)
+        return
+
+    tried = set()
+    while True:
+        name, opened = await scheduler.race(
+            [b for b in chain if b[0] not in tried],
+            lambda backend: _open_stream(backend[0], backend[2], context, query),
+            good=lambda r: r is not None and r[1] is not None,
+            discard=_close_stream, mode="first", tried=tried,
+        )
+        if name is None:
+            break
+        text, agen = opened
+        ttft = time.perf_counter() - t0
+        yield {"type": "token", "text": text}
+        try:
+            async for piece in agen:
+                text += piece
+                yield {"type": "token", "text": piece}
+        except Exception as e:
+            print(f"{name} stream error: {e}")
+            scheduler.fail(name)
+            text = None
+        finally:
+            await agen.aclose()
+        if _is_bad(text):
+            yield {"type": "reset"}
+            continue
+        _cache.put(key, text)
+        yield done(text, name, ttft)
+        return
+
+    text = _rule_based(context, query)
+    yield {"type": "token", "text": text}
+    yield done(text, "rule_based", time.perf_counter() - t0)
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+
+def backend_stats() -> dict:
+    return scheduler.stats()
@@ -0,0 +1,186 @@
+"""
+IndustrialRAG - LLM Backend Scheduler
+Tracks latency and failures per backend, trips a circuit breaker on repeated
+failures, and hedges: if the running backend is slower than its usual
+LLM_HEDGE_PCTL latency, the next backend is started in parallel and the first
+grounded answer wins. Keeps tail latency bounded when Ollama is overloaded.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+LLM_HEDGE_PCTL       = float(os.environ.get("LLM_HEDGE_PCTL", "90"))       # 0 = no hedging, strict fallback order
+LLM_HEDGE_DEFAULT_S  = float(os.environ.get("LLM_HEDGE_DEFAULT_S", "10"))  # until a backend has enough samples
+LLM_HEDGE_MIN_S      = float(os.environ.get("LLM_HEDGE_MIN_S", "1"))
+LLM_BREAKER_FAILS    = int(os.environ.get("LLM_BREAKER_FAILS", "3"))       # consecutive failures to open
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30")) # seconds before a trial request
+
+_MIN_SAMPLES = 5
+
+
+class BackendHealth:
+    """Rolling latencies (per mode: full answer / first tokens) and a circuit breaker."""
+
+    def __init__(self, name: str):
+        self.name      = name
+        self.latency   = {"full": deque(maxlen=100), "first": deque(maxlen=100)}
+        self.failures  = 0          # consecutive
+        self.opened_at = None
+        self.trial     = False      # half-open: the one trial request is in flight
+        self.calls     = 0
+        self.errors    = 0
+        self._lock     = threading.Lock()
+
+    def _cooled(self) -> bool:
+        return time.time() - self.opened_at >= LLM_BREAKER_COOLDOWN
+
+    def available(self) -> bool:
+        """Closed, or open long enough that a trial request may go through (half-open) and none has."""
+        return self.opened_at is None or (self._cooled() and not self.trial)
+
+    def begin(self) -> bool:
+        """Claim a request. While half-open only the first caller gets through, until its trial settles."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or not self._cooled():
+                return False
+            self.trial = True
+            return True
+
+    def release(self):
+        """A claimed request was abandoned before it settled; let another caller take the trial."""
+        with self._lock:
+            self.trial = False
+
+    def ok(self, seconds: float, mode: str):
+        with self._lock:
+            self.calls += 1
+            self.failures, self.opened_at, self.trial = 0, None, False
+            self.latency[mode].append(seconds)
+
+    def fail(self):
+        with self._lock:
+            self.calls    += 1
+            self.errors   += 1
+            self.failures += 1
+            if self.failures >= LLM_BREAKER_FAILS:
+                self.opened_at = time.time()   # (re)open; a failed trial restarts the cooldown
+            self.trial = False
+
+    def hedge_delay(self, mode: str) -> float:
+        lat = self.latency[mode]
+        if len(lat) < _MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_S
+        return max(LLM_HEDGE_MIN_S, float(np.percentile(lat, LLM_HEDGE_PCTL)))
+
+    def to_dict(self) -> dict:
+        state = "closed" if self.opened_at is None else ("half-open" if self._cooled() else "open")
+        out   = {"state": state, "calls": self.calls, "errors": self.errors}
+        for mode, lat in self.latency.items():
+            if lat:
+                out[f"{mode}_p50_s"] = round(float(np.percentile(lat, 50)), 2)
+                out[f"{mode}_p90_s"] = round(float(np.percentile(lat, 90)), 2)
+        return out
+
+
+class Scheduler:
+    def __init__(self):
+        self.health = {}
+        self._stats = {"hedges": 0, "hedge_wins": 0, "skipped_open": 0}
+
+    def _health(self, name: str) -> BackendHealth:
+        if name not in self.health:
+            self.health[name] = BackendHealth(name)
+        return self.health[name]
+
+    def fail(self, name: str):
+        self._health(name).fail()
+
+    async def race(self, chain: list, start, good, discard=None, mode: str = "full", tried: set = None):
+        """
+        chain: [(name, ...)] in priority order; start(entry) is a coroutine
+        giving a result, None meaning the backend failed. Backends with an
+        open breaker are skipped. Returns (name, result) for the first result
+        passing good(), preferring higher priority on ties, or (None, None).
+        Results that lose are passed to `await discard(result)`.
+        """
+        tried   = set() if tried is None else tried
+        pending = []
+        for entry in chain:
+            if self._health(entry[0]).available():
+                pending.append(entry)
+            else:
+                self._stats["skipped_open"] += 1
+        running = {}        # task → (name, priority, started, hedged)
+        winner  = None
+
+        def launch(hedged: bool):
+            while pending:
+                entry = pending.pop(0)
+                if not self._health(entry[0]).begin():
+                    self._stats["skipped_open"] += 1       # another request holds the trial
+                    continue
+                tried.add(entry[0])
+                task  = asyncio.ensure_future(start(entry))
+                running[task] = (entry[0], chain.index(entry), time.perf_counter(), hedged)
+                return
+
+        try:
+            while winner is None and (pending or running):
+                if not running:
+                    launch(hedged=False)
+                    if not running:
+                        break
+                timeout = None
+                if pending and LLM_HEDGE_PCTL > 0:
+                    name, _, started, _ = max(running.values(), key=lambda r: r[2])
+                    timeout = max(0.0, started + self._health(name).hedge_delay(mode) - time.perf_counter())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._stats["hedges"] += 1
+                    launch(hedged=True)
+                    continue
+                finished = []
+                for task in done:
+                    name, prio, started, hedged = running.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        print(f"{name} error: {e}")
+                        result = None
+                    if result is None:
+                        self._health(name).fail()
+                    else:
+                        self._health(name).ok(time.perf_counter() - started, mode)
+                    finished.append((prio, name, hedged, result))
+                for prio, name, hedged, result in sorted(finished, key=lambda f: f[0]):
+                    if winner is None and good(result):
+                        winner = (name, result)
+                        if hedged:
+                            self._stats["hedge_wins"] += 1
+                    elif discard and result is not None:
+                        await discard(result)
+        finally:
+            for task, (name, *_) in running.items():
+                task.cancel()
+                self._health(name).release()
+            for task in running:            # losers still in flight
+                try:
+                    result = await task
+                except BaseException:
+                    continue
+                if discard and result is not None:
+                    await discard(result)
+        return winner or (None, None)
+
+    def stats(self) -> dict:
+        return dict(self._stats, backends={n: h.to_dict() for n, h in self.health.items()})
+
+
+scheduler = Scheduler()
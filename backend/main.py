@@ -3,8 +3,18 @@ IndustrialRAG - FastAPI Backend
 """
 
 import os
+import json
+import time
 import shutil
-from pathlib import Path
+import hashlib
+import asyncio
+import threading
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures, FIRST_COMPLETED
+from contextlib import ExitStack, nullcontext
+from pathlib import Path, PurePosixPath
+from typing import List
 
 import numpy as np
 import faiss
@@ -13,120 +23,472 @@ import pickle
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
-import pdfplumber
-
-# OCR fallback for scanned PDFs
-def _ocr_page(page):
-    """Convert a pdfplumber page to image and OCR it. Returns text or empty string."""
-    try:
-        import pytesseract
-        from PIL import Image
-        import io
-        # Render page to image at 300 DPI
-        img = page.to_image(resolution=300).original
-        return pytesseract.image_to_string(img)
-    except ImportError:
-        return ""  # pytesseract/Pillow not installed — skip OCR
-    except Exception:
-        return ""
-
 import sys
 sys.path.append(str(Path(__file__).parent))
-from llm_formatter import generate_formatted_response
-import pandas as pd
-from sentence_transformers import SentenceTransformer
+from llm_formatter import agenerate_formatted_response, stream_formatted_response, cache_stats as llm_cache_stats, backend_stats
+from llm_clients import pool as llm_pool
+from vector_index import VectorIndex, ShardedIndex, shard_key, MMAP_CODES
+from segment_store import SegmentStore
+from index_manager import IndexManager
+from meta_store import MetaStore, text_hash
+from jobs import JobStore, JobCancelled
+from ocr import PageOCR
+from embed_cache import EmbeddingCache
+from embedder import load_engine, embedding_id, EMBED_ENGINE
+from query_cache import QueryCache
 
 # ── Paths ──
 BASE_DIR   = Path(__file__).parent.parent
 PDF_DIR    = BASE_DIR / "uploads" / "pdfs"
 EXCEL_DIR  = BASE_DIR / "uploads" / "excels"
+STAGE_DIR  = BASE_DIR / "uploads" / "staging"     # uploads waiting for their ingestion job
 VS_DIR     = BASE_DIR / "vectorstore"
-INDEX_PATH = VS_DIR / "index.faiss"
+INDEX_PATH = VS_DIR / "index.faiss"      # legacy layouts, migrated into the segment store
+SHARD_DIR  = VS_DIR / "shards"
 META_PATH  = VS_DIR / "metadata.pkl"
+META_DB    = VS_DIR / "metadata.db"
 
-for d in [PDF_DIR, EXCEL_DIR, VS_DIR]:
+for d in [PDF_DIR, EXCEL_DIR, STAGE_DIR, VS_DIR]:
     d.mkdir(parents=True, exist_ok=True)
 
 # ── Constants ──
+EMBED_MODEL         = "all-MiniLM-L6-v2"
 EMBEDDING_DIM       = 384
 CHUNK_CHARS         = 2400
 OVERLAP_CHARS       = 400
 RELEVANCE_THRESHOLD = 0.35
+INGEST_WORKERS      = int(os.environ.get("INGEST_WORKERS", "2"))   # concurrent uploads being parsed/embedded
+EMBED_BATCH         = 64
+EMBED_AHEAD         = int(os.environ.get("EMBED_AHEAD", "4"))      # micro-batches an upload or bulk import may queue for the embedder
+QUERY_BATCH         = int(os.environ.get("QUERY_BATCH", "256"))    # /query/batch questions embedded and searched together
+FORMAT_CONCURRENCY  = int(os.environ.get("FORMAT_CONCURRENCY", "4"))  # answers generated at once per batch request
+BULK_BATCH          = int(os.environ.get("BULK_BATCH", "2048"))    # bulk import: chunks committed together
+BULK_PARSERS        = int(os.environ.get("BULK_PARSERS", "2"))     # bulk import: files extracted alongside embedding
+
+# ── Serving role ──
+# all:    one process does everything (default).
+# writer: ingestion, deletes and jobs; checkpoints after every change so readers see it.
+# reader: serves queries from the writer's latest checkpoint, memory-mapped
+#         read-only, and forwards writes to WRITER_URL. Run several (uvicorn --workers).
+ROLE              = os.environ.get("ROLE", "all").lower()
+WRITER_URL        = os.environ.get("WRITER_URL", "http://127.0.0.1:8010")
+GENERATION_POLL_S = float(os.environ.get("GENERATION_POLL_S", "0.2"))   # how often readers look for a new checkpoint
 
 # ── Embedder ──
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+# Loaded on first use or by the startup warm-up, not at import, so /health
+# and metadata endpoints answer while the model is still loading.
+_embedder      = None
+_embedder_lock = threading.Lock()
+
+def _get_embedder():
+    """EMBED_ENGINE picks the runtime (torch, torch-int8, onnx, onnx-int8); see embedder.py."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            engine = load_engine(EMBED_MODEL, cache_dir=VS_DIR / "onnx")
+            if engine.dim != EMBEDDING_DIM:
+                raise RuntimeError(f"{EMBED_MODEL} on {engine.name} gives {engine.dim}-dim vectors, index needs {EMBEDDING_DIM}")
+            _embedder = engine
+    return _embedder
+
+def _encode(texts: list):
+    return _get_embedder().encode(texts)
+
+# Every encode goes through the cache: uploads, queries, restarts
+embed_cache = EmbeddingCache(VS_DIR / "embed_cache.db", embedding_id(EMBED_MODEL), _encode, EMBEDDING_DIM)
 
 # ── Index helpers ──
 def _make_index():
-    """Always returns a fresh IndexIDMap wrapping IndexFlatL2."""
-    return faiss.IndexIDMap(faiss.IndexFlatL2(EMBEDDING_DIM))
+    """Always returns a fresh, empty ShardedIndex of the configured INDEX_TYPE."""
+    return ShardedIndex(EMBEDDING_DIM)
 
-def _load_index():
+def _load_meta():
+    with open(META_PATH, "rb") as f:
+        meta = pickle.load(f)
+    # Migrate list → dict if needed
+    if isinstance(meta, list):
+        meta = {i: m for i, m in enumerate(meta)}
+    return meta
+
+def _load_legacy():
     """
-    Load saved index. If it exists but is NOT an IndexIDMap (old format),
-    discard it and return a fresh one. Never crash on old data.
+    Read a pre-WAL layout: shards/ + metadata.pkl, or a single index.faiss
+    which is split into per-machine shards using its metadata. If it carries
+    no ids (old format), discard it and return a fresh one.
     """
+    if ShardedIndex.exists(SHARD_DIR) and META_PATH.exists():
+        return ShardedIndex.read(SHARD_DIR), _load_meta()
     if INDEX_PATH.exists() and META_PATH.exists():
+        single = VectorIndex.from_faiss(faiss.read_index(str(INDEX_PATH)))
+        if single is None:
+            print("WARNING: Old index format detected. Rebuilding as IndexIDMap.")
+            print("You will need to re-upload your documents.")
+            return _make_index(), {}
+        meta   = _load_meta()
+        loaded = ShardedIndex.from_single(single, meta)
+        print(f"Split index.faiss into {len(loaded.shards)} machine shards")
+        return loaded, meta
+    return _make_index(), {}
+
+def _load_index():
+    """
+    Open the last checkpoint and replay the WAL. A legacy layout becomes the
+    first checkpoint and its metadata moves into SQLite. Never crash on old data.
+    """
+    if store.exists():
         try:
-            loaded = faiss.read_index(str(INDEX_PATH))
-            # Check it supports remove_ids (IndexIDMap does, IndexFlatL2 does not)
-            if not hasattr(loaded, "remove_ids"):
-                print("WARNING: Old index format detected. Rebuilding as IndexIDMap.")
-                print("You will need to re-upload your documents.")
-                return _make_index(), {}
-            with open(META_PATH, "rb") as f:
-                meta = pickle.load(f)
-            # Migrate list → dict if needed
-            if isinstance(meta, list):
-                meta = {i: m for i, m in enumerate(meta)}
-            return loaded, meta
+            loaded = store.load(EMBEDDING_DIM, metadata_store)
+            orphans = metadata_store.remove_above(store.max_id)
+            if orphans:
+                print(f"Dropped {orphans} metadata rows without vectors")
+            return loaded
         except Exception as e:
-            print(f"WARNING: Could not load saved index ({e}). Starting fresh.")
-    return _make_index(), {}
+            # Fail readiness instead of starting empty: metadata.db still holds every chunk,
+            # file hash and id, and stays untouched until the checkpoint can be read again.
+            raise RuntimeError(f"saved index in {VS_DIR} is unreadable ({e}); "
+                               "metadata.db left as is — fix or move the vectorstore aside") from e
+    try:
+        loaded, meta = _load_legacy()
+    except Exception as e:
+        print(f"WARNING: Could not load saved index ({e}). Starting fresh.")
+        return _make_index()
+    if meta:
+        metadata_store.clear()
+        metadata_store.add(list(meta), list(meta.values()))
+        store.max_id = max(meta)
+        store.compact(loaded)
+        shutil.rmtree(SHARD_DIR, ignore_errors=True)
+        INDEX_PATH.unlink(missing_ok=True)
+        META_PATH.unlink(missing_ok=True)
+    return loaded
 
-index, metadata_store = _load_index()
-_id_counter = max(metadata_store.keys(), default=-1) + 1
+# /query results per machine; versions are bumped on every change to a machine's chunks
+query_cache = QueryCache()
+_stale      = set()     # machines changed by the write in progress, invalidated once it is published
 
-def _next_id():
-    global _id_counter
-    v = _id_counter
-    _id_counter += 1
-    return v
+def _published(version: int):
+    query_cache.invalidate(_stale)
+    _stale.clear()
 
-def _save():
-    faiss.write_index(index, str(INDEX_PATH))
-    with open(META_PATH, "wb") as f:
-        pickle.dump(metadata_store, f)
+store          = SegmentStore(VS_DIR)
+metadata_store = MetaStore(META_DB)
+# Uploads run on worker threads while queries keep being served. Queries
+# search indexes.snapshot() without locking; every FAISS mutation happens
+# inside indexes.write(). Opened by _warm_up(); call _wait_index() first.
+indexes        = IndexManager(on_publish=_published)
+_index_ready   = threading.Event()
+_ingest_pool   = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_embed_pool    = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")   # shared by all uploads, see _Embedder
+
+# OCR fallback for scanned PDFs: process pool shared by all uploads, page cache on disk
+page_ocr = PageOCR(VS_DIR / "ocr_cache.db")
+
+# ── Startup ──
+LAZY_STARTUP = os.environ.get("LAZY_STARTUP", "true").lower() == "true"   # false = load everything before serving
+STARTUP_WAIT = float(os.environ.get("STARTUP_WAIT", "120"))              # seconds a request waits for the index before 503
 
-def _embed_and_store(texts: list, metas: list):
-    if not texts:
+_startup = {"index": "loading", "embedder": "loading", "index_s": None, "embedder_s": None, "error": None}
+
+def _warm_up():
+    """Open the index (WAL replay, legacy migration), then load the embedder."""
+    t0 = time.perf_counter()
+    try:
+        if ROLE == "reader":
+            if not MMAP_CODES:
+                print(f"WARNING: faiss {faiss.__version__} cannot memory-map flat/HNSW shards (needs ≥ 1.11) "
+                      "— every query worker holds its own copy of the index.")
+            while not store.exists():
+                time.sleep(0.5)             # the writer publishes the first checkpoint
+            _generation["seq"], loaded = store.open_snapshot(EMBEDDING_DIM)
+        else:
+            loaded = _load_index()
+        indexes.publish(loaded)
+        if ROLE == "writer" and (store.pending or not store.exists()):
+            _save()                         # readers only ever see checkpoints
+        _startup["index"] = "ready"
+    except Exception as e:
+        print(f"WARNING: Could not open index ({e}).")
+        _startup["index"], _startup["error"] = "failed", str(e)
+    finally:
+        _startup["index_s"] = round(time.perf_counter() - t0, 2)
+        _index_ready.set()
+
+    t0 = time.perf_counter()
+    try:
+        _get_embedder()
+        _startup["embedder"] = "ready"
+    except Exception as e:
+        # _encode retries on the next request
+        print(f"WARNING: Could not load embedding model ({e}).")
+        _startup["embedder"], _startup["error"] = "failed", str(e)
+    _startup["embedder_s"] = round(time.perf_counter() - t0, 2)
+
+def _wait_index(timeout=STARTUP_WAIT):
+    """Block until the index is open. 503 if it takes longer than `timeout` or failed to open."""
+    if not _index_ready.wait(timeout):
+        raise HTTPException(503, "Index is still loading, retry shortly")
+    if indexes.snapshot() is None:
+        raise HTTPException(503, f"Index failed to open: {_startup['error']}")
+    _follow_writer()
+
+# ── Generations (multi-process serving) ──
+_generation      = {"seq": None, "checked": 0.0}
+_generation_lock = threading.Lock()
+
+def _publish():
+    """Writer: checkpoint now, so reader processes pick the change up."""
+    if ROLE != "writer":
         return
-    vecs = embedder.encode(texts, show_progress_bar=False, normalize_embeddings=True)
-    ids  = [_next_id() for _ in texts]
-    index.add_with_ids(
-        np.array(vecs, dtype="float32"),
-        np.array(ids,  dtype="int64")
-    )
-    for vid, meta in zip(ids, metas):
-        metadata_store[vid] = meta
-    _save()
+    with indexes.write():
+        if store.pending:
+            _save()
 
-def _remove_by_source(source_pdf=None, source_excel=None) -> int:
-    to_remove = []
-    for vid, meta in list(metadata_store.items()):
-        if source_pdf   and meta.get("source_pdf")   == source_pdf:
-            to_remove.append(vid)
-        if source_excel and meta.get("source_excel") == source_excel:
-            to_remove.append(vid)
-    if to_remove:
-        index.remove_ids(np.array(to_remove, dtype="int64"))
-        for vid in to_remove:
-            del metadata_store[vid]
+def _follow_writer(force: bool = False):
+    """Reader: swap to the writer's newest checkpoint. Looks at most every GENERATION_POLL_S."""
+    if ROLE != "reader" or indexes.snapshot() is None:
+        return
+    now = time.monotonic()
+    if not force and now - _generation["checked"] < GENERATION_POLL_S:
+        return
+    _generation["checked"] = now
+    if store.checkpoint_seq() in (None, _generation["seq"]):
+        return
+    with _generation_lock:
+        try:
+            seq, loaded = store.open_snapshot(EMBEDDING_DIM)
+        except Exception as e:
+            print(f"WARNING: Could not open new index generation ({e}). Serving the previous one.")
+            return
+        if seq == _generation["seq"]:
+            return
+        indexes.publish(loaded)     # searches in flight keep the old mapping until they finish
+        _generation["seq"] = seq
+        metadata_store.reload()
+        query_cache.clear()
+
+def _kb_version() -> int:
+    """Changes with every upload, delete or reset; the same in every process serving one checkpoint."""
+    return _generation["seq"] if ROLE == "reader" else store.seq
+
+def _chunk_count() -> int:
+    snap = indexes.snapshot()
+    return snap.ntotal if snap is not None else len(metadata_store)
+
+if LAZY_STARTUP:
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+else:
+    _warm_up()
+
+def _new_ids(n: int) -> list:
+    """Fresh vector ids, reserved in the metadata database so no two threads or processes share one."""
+    start = metadata_store.reserve_ids(n, floor=store.max_id + 1)
+    return list(range(start, start + n))
+
+def _save():
+    """Full checkpoint: snapshot the index and truncate the WAL. Readers keep searching meanwhile."""
+    with indexes.write() as draft:
+        store.compact(draft)
+
+def _maybe_compact():
+    if ROLE == "writer":
+        return              # checkpointed once the whole operation is done, see _publish()
+    if store.needs_compaction():
         _save()
-    return len(to_remove)
+
+def _embed_texts(texts: list):
+    out = [embed_cache.encode(texts[i:i + EMBED_BATCH]) for i in range(0, len(texts), EMBED_BATCH)]
+    return np.vstack(out) if out else np.zeros((0, EMBEDDING_DIM), dtype="float32")
+
+def _store_vectors(vecs, metas: list):
+    ids  = _new_ids(len(metas))
+    keys = [shard_key(m["machine_name"], m.get("source", "manual")) for m in metas]
+    with indexes.write() as draft:
+        metadata_store.add(ids, metas)
+        store.append_add(vecs, ids, keys)
+        draft.add(
+            np.array(vecs, dtype="float32"),
+            np.array(ids,  dtype="int64"),
+            keys,
+        )
+        _stale.update(m["machine_name"] for m in metas)
+        _maybe_compact()
+
+def _remove_ids(ids: list, keys: list):
+    if ids:
+        with indexes.write() as draft:
+            store.append_remove(ids, keys)
+            draft.remove(np.array(ids, dtype="int64"), keys)
+            metadata_store.remove(ids)
+            _stale.update(machine for machine, _ in keys)
+            _maybe_compact()
+
+def _remove_by_source(source_pdf=None, source_excel=None) -> int:
+    with indexes.write():
+        rows = metadata_store.ids_for_source(source_pdf, source_excel)
+        _remove_ids([vid for vid, _, _ in rows], [shard_key(machine, source) for _, machine, source in rows])
+    return len(rows)
+
+# ── Content-addressed re-uploads ──
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _unchanged_file(filename: str, machine_name: str, sha: str):
+    """The indexed file entry if these exact bytes are already indexed for this machine."""
+    if metadata_store.file_hash(filename) != sha:
+        return None
+    return next((f for f in metadata_store.files()
+                 if f["filename"] == filename and f["machine"] == machine_name), None)
+
+def _old_chunks(source_pdf=None, source_excel=None) -> dict:
+    """A file's indexed chunks: (text hash, shard key) → vector ids."""
+    old = {}
+    for vid, machine, source, h in metadata_store.hashes_for_source(source_pdf, source_excel):
+        old.setdefault((h, shard_key(machine, source)), []).append(vid)
+    return old
+
+def _replace_files(files: list, job) -> list:
+    """
+    Swap the indexed chunks of one or more files, as returned by _pipeline()
+    plus their sha, for new versions in one commit. Chunks whose text is
+    unchanged keep their vector id and only have their metadata rewritten;
+    new or edited chunks get the vectors the pipeline computed; chunks no
+    longer present are removed.
+    """
+    def match(f):
+        old = _old_chunks(f.get("source_pdf"), f.get("source_excel"))
+        reuse, fresh = [], []
+        for i, m in enumerate(f["metas"]):
+            ids = old.get((text_hash(m["text"]), shard_key(m["machine_name"], m["source"])))
+            if ids:
+                reuse.append((ids.pop(), m))
+            else:
+                fresh.append(i)
+        stale = [(vid, key) for (_, key), ids in old.items() for vid in ids]
+        return reuse, fresh, stale
+
+    job.check()
+    with indexes.write():
+        # Same-file uploads and deletes are serialised by the file lock, but a
+        # reset may have wiped the old chunks meanwhile — embed whatever is gone.
+        plans = [match(f) for f in files]
+        fresh = [(n, i) for n, (_, now, _) in enumerate(plans) for i in now]
+        extra = [(n, i) for n, i in fresh if i not in files[n]["vecs"]]
+        for (n, i), vec in zip(extra, _embed_texts([files[n]["metas"][i]["text"] for n, i in extra])):
+            files[n]["vecs"][i] = vec
+        stale = [s for _, _, st in plans for s in st]
+        reuse = [r for re, _, _ in plans for r in re]
+        _remove_ids([vid for vid, _ in stale], [key for _, key in stale])
+        if reuse:
+            metadata_store.add([vid for vid, _ in reuse], [m for _, m in reuse])
+            _stale.update(m["machine_name"] for _, m in reuse)    # page numbers may have moved
+        if fresh:
+            _store_vectors(np.vstack([files[n]["vecs"][i] for n, i in fresh]),
+                           [files[n]["metas"][i] for n, i in fresh])
+        for f in files:
+            metadata_store.set_file_hash(f.get("source_pdf") or f.get("source_excel"), f["sha"])
+    return [
+        {"replaced": len(st), "reused": len(re), "embedded": len(now)}
+        for re, now, st in plans
+    ]
+
+# ── Ingestion pipeline ──
+class _Embedder:
+    """
+    Micro-batches new chunks into EMBED_BATCH encode calls on the embedder
+    thread. One per single upload; a bulk import's parser threads share one,
+    so small files fill batches together. Once EMBED_AHEAD batches are
+    waiting, put() blocks, so parsing never runs far ahead of embedding.
+    """
+
+    def __init__(self, job):
+        self.job    = job
+        self._lock  = threading.Lock()
+        self._slots = threading.Semaphore(EMBED_AHEAD)
+        self._batch = []        # (vecs, chunk no., text) not sent yet
+        self._sent  = []        # futures not waited for yet
+
+    def put(self, vecs: dict, i: int, text: str):
+        """Embed `text` into vecs[i] (some time before the next wait())."""
+        with self._lock:
+            self._batch.append((vecs, i, text))
+            self.job.progress(chunks_total=self.job.chunks_total + 1)
+            if len(self._batch) < EMBED_BATCH:
+                return
+            batch, self._batch = self._batch, []
+        self._submit(batch)
+
+    def wait(self):
+        """Send the partial batch and block until everything put so far is embedded."""
+        with self._lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self._submit(batch)
+        with self._lock:
+            pending, self._sent = set(self._sent), []
+        while pending:
+            self.job.check()
+            done, pending = wait_futures(pending, timeout=0.5)
+            for fut in done:
+                fut.result()
+
+    def cancel(self):
+        with self._lock:
+            for fut in self._sent:
+                fut.cancel()
+
+    def _submit(self, batch: list):
+        while not self._slots.acquire(timeout=0.5):
+            self.job.check()
+        fut = _embed_pool.submit(self._encode, batch)
+        with self._lock:
+            self._sent.append(fut)
+
+    def _encode(self, batch: list):
+        try:
+            for (vecs, i, _), vec in zip(batch, embed_cache.encode([text for _, _, text in batch])):
+                vecs[i] = vec
+            with self._lock:
+                self.job.progress(chunks_embedded=self.job.chunks_embedded + len(batch))
+        finally:
+            self._slots.release()
+
+def _pipeline(chunks, job, embedder: _Embedder = None, source_pdf=None, source_excel=None) -> dict:
+    """
+    Embed one file's chunks while its parser is still producing them.
+    `chunks` yields chunk metadata as pages are read; chunks the index
+    already holds with the same text are left for _replace_files() to reuse,
+    the rest go to `embedder`. Without one, the file gets its own and is
+    fully embedded on return; a shared one fills "vecs" by its next wait().
+    Returns {"metas", "vecs": {chunk no.: vector}, "source_pdf"/"source_excel"}.
+    """
+    own      = embedder is None
+    embedder = embedder or _Embedder(job)
+    old      = Counter({k: len(ids) for k, ids in _old_chunks(source_pdf, source_excel).items()})
+    metas    = []
+    vecs     = {}
+    try:
+        for meta in chunks:
+            key = (text_hash(meta["text"]), shard_key(meta["machine_name"], meta["source"]))
+            if old[key] > 0:
+                old[key] -= 1
+            else:
+                embedder.put(vecs, len(metas), meta["text"])
+            metas.append(meta)
+        if own:
+            embedder.wait()
+    except BaseException:
+        if own:
+            embedder.cancel()
+        raise
+    return {"metas": metas, "vecs": vecs, "source_pdf": source_pdf, "source_excel": source_excel}
 
 # ── Text chunker ──
 def _chunk(text: str) -> list:
@@ -142,55 +504,50 @@ def _chunk(text: str) -> list:
     return out
 
 # ── Retrieval ──
-def _retrieve(query: str, machine: str, top_manual=5, top_log=3) -> list:
-    if index.ntotal == 0:
-        return []
-    q_vec = embedder.encode([query], normalize_embeddings=True)
-    k = min(index.ntotal, (top_manual + top_log) * 10)
-    distances, ids = index.search(np.array(q_vec, dtype="float32"), k)
-
-    manual, logs = [], []
-    for dist, idx in zip(distances[0], ids[0]):
-        if idx < 0 or idx not in metadata_store:
-            continue
-        score = float(1.0 - dist / 2.0)
-        if score < RELEVANCE_THRESHOLD:
-            continue
-        meta = metadata_store[idx]
-        if machine.lower() != "all" and meta.get("machine_name", "").lower() != machine.lower():
-            continue
-        row = {**meta, "score": round(score, 3)}
-        if meta.get("source") == "repair_log":
-            if len(logs) < top_log:
-                logs.append(row)
-        else:
-            if len(manual) < top_manual:
-                manual.append(row)
-        if len(manual) >= top_manual and len(logs) >= top_log:
-            break
+def _shard_keys(snap, machine: str, source: str) -> list:
+    if machine.lower() == "all":
+        return snap.keys(source)
+    return [shard_key(machine, source)]
+
+def _search_shards(snap, q_vec, machine: str, source: str, top: int) -> list:
+    """Top hits above threshold from only this machine's shard for `source`, in index version `snap`."""
+    return _search_shards_many(snap, q_vec, machine, source, top)[0]
+
+def _search_shards_many(snap, q_vecs, machine: str, source: str, top: int) -> list:
+    """_search_shards for a matrix of query vectors: one search per shard, one metadata read."""
+    distances, ids = snap.search(q_vecs, top, _shard_keys(snap, machine, source))
+    hits = [
+        [
+            (int(idx), float(1.0 - dist / 2.0))
+            for dist, idx in zip(d_row, i_row)
+            if idx >= 0 and 1.0 - dist / 2.0 >= RELEVANCE_THRESHOLD
+        ]
+        for d_row, i_row in zip(distances, ids)
+    ]
+    # Text is only read from disk for the hits that survive the threshold. Ids
+    # removed since `snap` was taken have no metadata any more and are skipped.
+    metas = metadata_store.get_many({idx for row in hits for idx, _ in row})
+    return [
+        [{**metas[idx], "score": round(score, 3)} for idx, score in row if idx in metas]
+        for row in hits
+    ]
+
+def _embed_query(query: str):
+    return embed_cache.encode([query])
+
+def _retrieve_vec(snap, q_vec, machine: str, top_manual=5, top_log=3) -> list:
+    manual = _search_shards(snap, q_vec, machine, "manual",     top_manual)
+    logs   = _search_shards(snap, q_vec, machine, "repair_log", top_log)
     return manual + logs
 
 # ── Metadata helpers ──
 def _get_machines() -> list:
-    return sorted(set(
-        m["machine_name"] for m in metadata_store.values() if "machine_name" in m
-    ))
+    _follow_writer()
+    return metadata_store.machines()
 
 def _get_files() -> list:
-    files = {}
-    for meta in metadata_store.values():
-        key = meta.get("source_pdf") or meta.get("source_excel")
-        if not key:
-            continue
-        if key not in files:
-            files[key] = {
-                "filename": key,
-                "machine":  meta.get("machine_name", ""),
-                "type":     "pdf" if meta.get("source_pdf") else "excel",
-                "chunks":   0,
-            }
-        files[key]["chunks"] += 1
-    return list(files.values())
+    _follow_writer()
+    return metadata_store.files()
 
 # ── App ──
 app = FastAPI(title="IndustrialRAG")
@@ -199,86 +556,279 @@ app.add_middleware(
 )
 app.mount("/pdfs", StaticFiles(directory=str(PDF_DIR)), name="pdfs")
 
+_WRITE_PATHS   = ("/admin/upload/", "/admin/delete/", "/admin/reset", "/admin/jobs")
+_writer_client = None
+
+if ROLE == "reader":
+    @app.middleware("http")
+    async def _forward_writes(request, call_next):
+        """Readers never touch the index files: uploads, deletes, reset and jobs go to the writer."""
+        if not request.url.path.startswith(_WRITE_PATHS):
+            return await call_next(request)
+        global _writer_client
+        import httpx
+        if _writer_client is None:
+            _writer_client = httpx.AsyncClient(base_url=WRITER_URL, timeout=None)
+        r = await _writer_client.request(
+            request.method, request.url.path, params=request.query_params, content=await request.body(),
+            headers={k: v for k, v in request.headers.items() if k.lower() == "content-type"},
+        )
+        _follow_writer(force=True)          # read your own writes on this worker
+        return Response(r.content, r.status_code, media_type=r.headers.get("content-type"))
+
+# ── Ingestion jobs ──
+jobs             = JobStore(VS_DIR / "jobs.db")
+_file_locks      = {}
+_file_locks_lock = threading.Lock()
+
+def _file_lock(filename: str):
+    with _file_locks_lock:
+        return _file_locks.setdefault(filename, threading.Lock())
+
+def _queue_upload(kind: str, src, machine_name: str, filename: str):
+    """Stage the upload on disk and queue it. Returns (job, future). Blocking: run it in the threadpool."""
+    staged = STAGE_DIR / f"{os.urandom(6).hex()}_{filename}"
+    with open(staged, "wb") as out:
+        shutil.copyfileobj(src, out, 1 << 20)
+    job = jobs.create(kind, machine_name, filename, staged)
+    return job, _ingest_pool.submit(_run_job, job)
+
+def _run_job(job):
+    """
+    Worker entry point. Parsing and embedding happen first; old chunks are
+    only swapped out at the end, so a failed or cancelled job leaves the
+    previous version of the file searchable. Same-file uploads and deletes run in order.
+    """
+    if job.cancel_requested:
+        if job.status != "cancelled":
+            jobs.finish(job, "cancelled")
+        _unstage(job.staged)
+        return
+    # A bulk import locks each of its files while committing it
+    with _file_lock(job.filename) if job.kind != "bulk" else nullcontext():
+        jobs.start(job)
+        try:
+            _wait_index(timeout=None)
+            ingest     = {"pdf": _ingest_pdf, "excel": _ingest_excel, "bulk": _ingest_bulk}[job.kind]
+            job.result = ingest(job)
+            jobs.finish(job, "done")
+        except JobCancelled:
+            jobs.finish(job, "cancelled")
+        except HTTPException as e:
+            jobs.finish(job, "failed", e.detail, e.status_code)
+        except Exception as e:
+            jobs.finish(job, "failed", str(e), 500)
+        finally:
+            _unstage(job.staged)
+            _publish()
+
+def _unstage(staged: str):
+    """Remove what is left of a staged upload: a file, or a bulk import's directory."""
+    path = Path(staged)
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+async def _upload_response(job, fut, wait: bool):
+    if not wait:
+        return {
+            "status":   "queued",
+            "job_id":   job.id,
+            "machine":  job.machine_name,
+            "filename": job.filename,
+        }
+    await asyncio.wrap_future(fut)
+    if job.status == "cancelled":
+        raise HTTPException(409, "Upload cancelled")
+    if job.status != "done":
+        raise HTTPException(job.error_status or 500, job.error)
+    return job.result
+
+def _resume_jobs():
+    """Re-queue whatever was queued or running when the process last stopped."""
+    for job in jobs.pending():
+        if Path(job.staged).exists():
+            jobs.save(job)
+            _ingest_pool.submit(_run_job, job)
+        else:
+            jobs.finish(job, "failed", "Staged upload missing after restart", 500)
+
+@app.on_event("startup")
+def _resume_on_start():
+    # Not at import: a resumed job may start before the ingest functions below are defined
+    if ROLE != "reader":
+        _resume_jobs()
+
 # ── Upload PDF ──
 @app.post("/admin/upload/pdf")
-async def upload_pdf(file: UploadFile = File(...), machine_name: str = Form(...)):
+async def upload_pdf(file: UploadFile = File(...), machine_name: str = Form(...), wait: bool = False):
+    """Queue a PDF for ingestion. Returns a job id at once; pass ?wait=true to block until indexed."""
     machine_name = machine_name.strip()
     if not machine_name:
         raise HTTPException(400, "machine_name is required")
 
     safe_name = machine_name.replace(" ", "_")
     filename  = f"{safe_name}_{file.filename}"
-    filepath  = PDF_DIR / filename
-    data      = await file.read()
+    job, fut  = await run_in_threadpool(_queue_upload, "pdf", file.file, machine_name, filename)
+    return await _upload_response(job, fut, wait)
 
-    replaced = _remove_by_source(source_pdf=filename)
+def _ingest_pdf(job) -> dict:
+    staged, filename, machine_name = Path(job.staged), job.filename, job.machine_name
 
-    filepath.write_bytes(data)
+    # Byte-identical re-upload: nothing to parse, OCR or embed
+    sha  = _file_sha256(staged)
+    same = _unchanged_file(filename, machine_name, sha)
+    if same:
+        os.replace(staged, PDF_DIR / filename)
+        return {
+            "status":               "success",
+            "unchanged":            True,
+            "machine":              machine_name,
+            "filename":             filename,
+            "chunks_stored":        same["chunks"],
+            "old_chunks_replaced":  0,
+        }
 
-    texts, metas = [], []
-    try:
-        with pdfplumber.open(filepath) as pdf:
-            for page_num, page in enumerate(pdf.pages, start=1):
-                # Try native text extraction first (fast)
-                page_text = (page.extract_text() or "").strip()
-                # If empty, fall back to OCR (handles scanned PDFs)
-                if not page_text:
-                    page_text = _ocr_page(page).strip()
-                if not page_text:
-                    continue
-                for chunk in _chunk(page_text):
-                    texts.append(chunk)
-                    metas.append({
-                        "machine_name": machine_name,
-                        "source_pdf":   filename,
-                        "page_number":  page_num,
-                        "source":       "manual",
-                        "text":         chunk,
-                    })
-    except Exception as e:
-        filepath.unlink(missing_ok=True)
-        raise HTTPException(500, f"PDF parsing failed: {e}")
+    parsed = _parse_pdf(staged, filename, machine_name, job)
 
-    if not texts:
-        filepath.unlink(missing_ok=True)
-        raise HTTPException(422, "No readable text found. Install pytesseract + tesseract for scanned PDF support: pip install pytesseract Pillow && brew install tesseract")
-
-    _embed_and_store(texts, metas)
+    swap = _replace_files([dict(parsed, sha=sha)], job)[0]
+    os.replace(staged, PDF_DIR / filename)
     return {
         "status":               "success",
         "machine":              machine_name,
         "filename":             filename,
-        "chunks_stored":        len(texts),
-        "old_chunks_replaced":  replaced,
+        "chunks_stored":        len(parsed["metas"]),
+        "old_chunks_replaced":  swap["replaced"],
+        "chunks_reused":        swap["reused"],
+        "chunks_embedded":      swap["embedded"],
     }
 
+def _parse_pdf(staged: Path, filename: str, machine_name: str, job, embedder: _Embedder = None) -> dict:
+    """Read, chunk and embed a PDF as one pipeline, see _pipeline(). 422 if it has no text."""
+    parsed = _pipeline(_pdf_chunks(staged, filename, machine_name, job), job, embedder, source_pdf=filename)
+    if not parsed["metas"]:
+        raise HTTPException(422, "No readable text found. Install pytesseract + tesseract for scanned PDF support: pip install pytesseract Pillow && brew install tesseract")
+    return parsed
+
+def _pdf_chunks(staged: Path, filename: str, machine_name: str, job):
+    """
+    Chunk metadata of each page, in page order, as soon as its text (native,
+    cached or OCR) and that of every page before it is in. A scanned page
+    holds back the pages after it only until its OCR finishes.
+    """
+    import pdfplumber
+    held, emit = {}, 1          # page text read but not chunked yet, next page to chunk
+
+    def release():
+        nonlocal emit
+        while emit in held:
+            yield from _page_chunks(held.pop(emit), emit, filename, machine_name)
+            emit += 1
+
+    try:
+        with pdfplumber.open(staged) as pdf:
+            job.progress(pages_total=len(pdf.pages))
+            ocr = page_ocr.run(staged)
+            for page_num, page in enumerate(pdf.pages, start=1):
+                job.check()
+                # Native text layer first; unchanged pages come from the page cache
+                page_text, key = page_ocr.text_layer(page)
+                if page_text:
+                    held[page_num] = page_text
+                elif not ocr.add(page_num, page, key):     # empty: scanned page, OCR'd in the pool meanwhile
+                    held[page_num] = ""                     # no OCR available: nothing to wait for
+                page.close()                # pdfplumber keeps every parsed page's objects otherwise
+                for n, text in ocr.finished():
+                    held[n] = text.strip()
+                job.progress(pages_done=emit - 1 + len(held))
+                yield from release()
+            for n, text in ocr.results(check=job.check):
+                held[n] = text.strip()
+                job.progress(pages_done=emit - 1 + len(held))
+                yield from release()
+            job.progress(pages_done=len(pdf.pages))
+            if len(ocr):
+                print(f"OCR: {len(ocr)} scanned pages in {filename} ({ocr.hits} from cache)")
+    except JobCancelled:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"PDF parsing failed: {e}")
+
+def _page_chunks(page_text: str, page_num: int, filename: str, machine_name: str):
+    for chunk in _chunk(page_text):
+        yield {
+            "machine_name": machine_name,
+            "source_pdf":   filename,
+            "page_number":  page_num,
+            "source":       "manual",
+            "text":         chunk,
+        }
+
 # ── Upload Excel / CSV ──
 @app.post("/admin/upload/excel")
-async def upload_excel(file: UploadFile = File(...), machine_name: str = Form(...)):
+async def upload_excel(file: UploadFile = File(...), machine_name: str = Form(...), wait: bool = False):
+    """Queue an Excel/CSV repair log for ingestion. Same job semantics as PDF uploads."""
     machine_name = machine_name.strip()
     if not machine_name:
         raise HTTPException(400, "machine_name is required")
 
     safe_name = machine_name.replace(" ", "_")
     filename  = f"{safe_name}_{file.filename}"
-    filepath  = EXCEL_DIR / filename
-    data      = await file.read()
+    job, fut  = await run_in_threadpool(_queue_upload, "excel", file.file, machine_name, filename)
+    return await _upload_response(job, fut, wait)
 
-    replaced = _remove_by_source(source_excel=filename)
+def _ingest_excel(job) -> dict:
+    staged, filename, machine_name = Path(job.staged), job.filename, job.machine_name
 
-    filepath.write_bytes(data)
+    sha  = _file_sha256(staged)
+    same = _unchanged_file(filename, machine_name, sha)
+    if same:
+        os.replace(staged, EXCEL_DIR / filename)
+        job.progress(pages_total=1, pages_done=1)
+        return {
+            "status":              "success",
+            "unchanged":           True,
+            "machine":             machine_name,
+            "filename":            filename,
+            "rows_stored":         same["chunks"],
+            "old_rows_replaced":   0,
+        }
 
+    parsed = _parse_excel(staged, filename, machine_name, job)
+
+    swap = _replace_files([dict(parsed, sha=sha)], job)[0]
+    os.replace(staged, EXCEL_DIR / filename)
+    return {
+        "status":              "success",
+        "machine":             machine_name,
+        "filename":            filename,
+        "rows_stored":         len(parsed["metas"]),
+        "old_rows_replaced":   swap["replaced"],
+        "rows_reused":         swap["reused"],
+        "rows_embedded":       swap["embedded"],
+    }
+
+def _parse_excel(staged: Path, filename: str, machine_name: str, job, embedder: _Embedder = None) -> dict:
+    """Rows → chunks → vectors as one pipeline, see _pipeline(). 422 if there are none."""
+    parsed = _pipeline(_excel_rows(staged, filename, machine_name, job), job, embedder, source_excel=filename)
+    if not parsed["metas"]:
+        raise HTTPException(422, "No data rows found in file.")
+    return parsed
+
+def _excel_rows(staged: Path, filename: str, machine_name: str, job):
+    """One chunk per non-empty row, counted as one page."""
+    import pandas as pd
+    job.progress(pages_total=1)
     try:
-        if file.filename.lower().endswith(".csv"):
-            df = pd.read_csv(filepath)
+        if filename.lower().endswith(".csv"):
+            df = pd.read_csv(staged)
         else:
-            df = pd.read_excel(filepath)
+            df = pd.read_excel(staged)
         df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
     except Exception as e:
-        filepath.unlink(missing_ok=True)
         raise HTTPException(500, f"File parsing failed: {e}")
 
-    texts, metas = [], []
     for i, row in df.iterrows():
         parts = [
             f"{k.replace('_', ' ').title()}: {str(v).strip()}"
@@ -288,36 +838,255 @@ async def upload_excel(file: UploadFile = File(...), machine_name: str = Form(..
         row_text = "\n".join(parts)
         if not row_text.strip():
             continue
-        texts.append(row_text)
-        metas.append({
+        yield {
             "machine_name": machine_name,
             "source_excel": filename,
             "log_id":       f"row_{i}",
             "source":       "repair_log",
             "text":         row_text,
-        })
+        }
+    job.progress(pages_done=1)
 
-    if not texts:
-        filepath.unlink(missing_ok=True)
-        raise HTTPException(422, "No data rows found in file.")
+# ── Bulk import ──
+_BULK_KINDS = {".pdf": "pdf", ".xlsx": "excel", ".xls": "excel", ".csv": "excel"}
 
-    _embed_and_store(texts, metas)
+@app.post("/admin/upload/bulk")
+async def upload_bulk(files: List[UploadFile] = File(...), machine_name: str = Form(""), wait: bool = False):
+    """
+    Queue many manuals and repair logs as one import job: PDFs, Excel/CSV
+    files, or .zip archives with a folder per machine ("Pioneer 3/manual.pdf").
+    Loose files and files at the root of a zip need machine_name.
+    """
+    root, entries, skipped = await run_in_threadpool(_stage_bulk, files, machine_name.strip())
+    if not entries:
+        shutil.rmtree(root, ignore_errors=True)
+        raise HTTPException(400, f"No PDF, Excel or CSV files to import ({len(skipped)} skipped)")
+    machines = sorted({e["machine"] for e in entries})
+    label    = machines[0] if len(machines) == 1 else f"{len(machines)} machines"
+    job      = jobs.create("bulk", label, f"{len(entries)} files", root)
+    return await _upload_response(job, _ingest_pool.submit(_run_job, job), wait)
+
+def _stage_bulk(uploads: list, machine_name: str):
+    """
+    Copy the uploads into one staging directory, unpacking zips, and list
+    them in its manifest.json. Returns (directory, entries, skipped).
+    """
+    root = STAGE_DIR / f"{os.urandom(6).hex()}_bulk"
+    root.mkdir(parents=True)
+    entries, skipped = {}, []
+
+    def add(name: str, machine: str, src):
+        name, machine = Path(name).name, machine.strip()
+        kind = _BULK_KINDS.get(Path(name).suffix.lower())
+        if not kind or not machine:
+            skipped.append({"file": name, "error": "no machine name" if kind else "unsupported file type"})
+            return
+        filename = f"{machine.replace(' ', '_')}_{name}"
+        if filename in entries:
+            skipped.append({"file": name, "error": f"{filename} given more than once, first copy imported"})
+            return
+        dest = root / f"{len(entries):05d}{Path(name).suffix.lower()}"      # entries only grow: never reused
+        with open(dest, "wb") as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+        entries[filename] = {"kind": kind, "machine": machine, "filename": filename, "path": str(dest)}
+
+    for up in uploads:
+        if not up.filename.lower().endswith(".zip"):
+            add(up.filename, machine_name, up.file)
+            continue
+        try:
+            with zipfile.ZipFile(up.file) as zf:
+                for info in zf.infolist():
+                    parts = PurePosixPath(info.filename).parts
+                    if info.is_dir() or parts[0] == "__MACOSX" or parts[-1].startswith("."):
+                        continue
+                    with zf.open(info) as src:
+                        add(parts[-1], parts[0] if len(parts) > 1 else machine_name, src)
+        except zipfile.BadZipFile:
+            skipped.append({"file": up.filename, "error": "not a valid zip archive"})
+
+    entries = list(entries.values())
+    (root / "manifest.json").write_text(json.dumps({"files": entries, "skipped": skipped}))
+    return root, entries, skipped
+
+class _FileProgress:
+    """Stands in for the Job while one file of a bulk import is parsed; its pages add up on the bulk job."""
+
+    def __init__(self, job, lock: threading.Lock):
+        self.job         = job
+        self.lock        = lock
+        self.pages_total = 0
+        self.pages_done  = 0
+
+    def progress(self, **counters):
+        with self.lock:
+            totals = {}
+            for k, v in counters.items():
+                totals[k] = getattr(self.job, k) + v - getattr(self, k)
+                setattr(self, k, v)
+            self.job.progress(**totals)
+
+    def check(self):
+        self.job.check()
+
+def _ingest_bulk(job) -> dict:
+    """
+    Pipeline: up to BULK_PARSERS files are read at once, all feeding one
+    _Embedder as they go, so chunks of different files share encode calls.
+    Finished files are grouped until they hold BULK_BATCH chunks and each
+    group is committed to the index in one write. A file that fails is reported and the rest carry on.
+    Cancelling keeps the groups already committed; after a restart the job
+    carries on with the files the manifest does not list as done.
+    """
+    root     = Path(job.staged)
+    manifest = json.loads((root / "manifest.json").read_text())
+    done     = manifest.setdefault("done", [])
+    for f in done:
+        _move_committed(f)          # the process may have stopped between recording and moving
+    resumed  = len(done)
+    pending  = iter([e for e in manifest["files"] if e["filename"] not in {f["filename"] for f in done}])
+    lock     = threading.Lock()
+    embedder = _Embedder(job)
+    t0       = time.perf_counter()
+    batch, size, batches = [], 0, 0
+
+    with ThreadPoolExecutor(max_workers=BULK_PARSERS, thread_name_prefix="bulk-parse") as pool:
+        running = set()
+
+        def refill():
+            # A small window ahead of the embedder keeps memory bounded
+            while len(running) < 2 * BULK_PARSERS:
+                entry = next(pending, None)
+                if entry is None:
+                    return
+                running.add(pool.submit(_parse_bulk_file, entry, _FileProgress(job, lock), embedder))
+
+        refill()
+        try:
+            while running or batch:
+                if running:
+                    finished, running = wait_futures(running, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        f = fut.result()
+                        batch.append(f)
+                        size += len(f.get("metas", ()))
+                    refill()
+                if batch and (size >= BULK_BATCH or not running):
+                    job.check()
+                    embedder.wait()
+                    _commit_bulk(batch, job, root, manifest)
+                    batch, size, batches = [], 0, batches + 1
+        finally:
+            for fut in running:
+                fut.cancel()
+            embedder.cancel()
+
+    elapsed = time.perf_counter() - t0
+    files   = [{k: v for k, v in f.items() if k not in ("sha", "path")} for f in done]
+    count   = Counter(f["status"] for f in files)
+    read    = sum(f.get("pages", 0) for f in done[resumed:])
     return {
         "status":              "success",
-        "machine":             machine_name,
-        "filename":            filename,
-        "rows_stored":         len(texts),
-        "old_rows_replaced":   replaced,
+        "files":               len(files),
+        "indexed":             count["indexed"],
+        "unchanged":           count["unchanged"],
+        "failed":              count["failed"],
+        "skipped":             len(manifest["skipped"]),
+        "resumed":             resumed,
+        "pages":               sum(f.get("pages", 0) for f in files),
+        "chunks_stored":       sum(f.get("chunks", 0) for f in files),
+        "chunks_embedded":     sum(f.get("embedded", 0) for f in files),
+        "chunks_reused":       sum(f.get("reused", 0) for f in files),
+        "old_chunks_replaced": sum(f.get("replaced", 0) for f in files),
+        "batches":             batches,
+        "elapsed_s":           round(elapsed, 1),
+        "pages_per_s":         round(read / elapsed, 2) if elapsed > 0 else 0.0,
+        "details":             files + [dict(s, status="skipped") for s in manifest["skipped"]],
     }
 
+def _parse_bulk_file(entry: dict, progress: _FileProgress, embedder: _Embedder) -> dict:
+    """
+    Read one file on a parser thread into what _replace_files() takes, its
+    new chunks queued on the shared embedder, or mark it unchanged / failed.
+    """
+    f = {"filename": entry["filename"], "machine": entry["machine"], "kind": entry["kind"], "path": entry["path"]}
+    try:
+        f["sha"] = _file_sha256(Path(entry["path"]))
+        same     = _unchanged_file(entry["filename"], entry["machine"], f["sha"])
+        if same:
+            return dict(f, status="unchanged", chunks=same["chunks"])
+        parse    = _parse_pdf if entry["kind"] == "pdf" else _parse_excel
+        parsed   = parse(Path(entry["path"]), entry["filename"], entry["machine"], progress, embedder)
+    except JobCancelled:
+        raise
+    except HTTPException as e:
+        return dict(f, status="failed", error=e.detail)
+    except Exception as e:
+        return dict(f, status="failed", error=str(e))
+    return dict(f, **parsed, status="parsed", chunks=len(parsed["metas"]), pages=progress.pages_done)
+
+def _commit_bulk(batch: list, job, root: Path, manifest: dict):
+    """
+    Index one group of parsed files together, record them as done in the
+    manifest, then move them out of staging.
+    """
+    with ExitStack() as held:
+        for name in sorted({f["filename"] for f in batch}):     # same order everywhere: no deadlocks
+            held.enter_context(_file_lock(name))
+        parsed = [f for f in batch if f["status"] == "parsed"]
+        if parsed:
+            for f, swap in zip(parsed, _replace_files(parsed, job)):
+                f.update(swap, status="indexed")
+        for f in batch:
+            for k in ("metas", "vecs", "source_pdf", "source_excel"):
+                f.pop(k, None)
+        manifest["done"] += batch
+        tmp = root / "manifest.json.tmp"
+        tmp.write_text(json.dumps(manifest))
+        os.replace(tmp, root / "manifest.json")
+        for f in batch:
+            _move_committed(f)
+    _publish()              # reader processes see the import grow batch by batch
+
+def _move_committed(f: dict):
+    # Only files this import indexed. An unchanged one's bytes are already on disk, and
+    # its staged copy may be stale by now: a single upload can commit between the
+    # unchanged check and this move. It goes with the staging directory.
+    if f["status"] == "indexed" and Path(f["path"]).exists():
+        os.replace(f["path"], (PDF_DIR if f["kind"] == "pdf" else EXCEL_DIR) / f["filename"])
+
+# ── Jobs ──
+@app.get("/admin/jobs")
+def list_jobs(limit: int = 50):
+    return {"jobs": [j.to_dict() for j in jobs.recent(limit)]}
+
+@app.get("/admin/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Job '{job_id}' not found")
+    return job.to_dict()
+
+@app.post("/admin/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Job '{job_id}' not found")
+    if job.status in ("queued", "running"):
+        jobs.cancel(job)
+    return job.to_dict()
+
 # ── Delete single PDF ──
 @app.delete("/admin/delete/pdf/{filename}")
 def delete_pdf(filename: str):
-    removed  = _remove_by_source(source_pdf=filename)
-    filepath = PDF_DIR / filename
-    existed  = filepath.exists()
-    if existed:
-        filepath.unlink()
+    _wait_index()
+    with _file_lock(filename):
+        removed  = _remove_by_source(source_pdf=filename)
+        filepath = PDF_DIR / filename
+        existed  = filepath.exists()
+        if existed:
+            filepath.unlink()
+    _publish()
     if removed == 0 and not existed:
         raise HTTPException(404, f"'{filename}' not found")
     return {"status": "deleted", "filename": filename, "chunks_removed": removed}
@@ -325,11 +1094,14 @@ def delete_pdf(filename: str):
 # ── Delete single Excel ──
 @app.delete("/admin/delete/excel/{filename}")
 def delete_excel(filename: str):
-    removed  = _remove_by_source(source_excel=filename)
-    filepath = EXCEL_DIR / filename
-    existed  = filepath.exists()
-    if existed:
-        filepath.unlink()
+    _wait_index()
+    with _file_lock(filename):
+        removed  = _remove_by_source(source_excel=filename)
+        filepath = EXCEL_DIR / filename
+        existed  = filepath.exists()
+        if existed:
+            filepath.unlink()
+    _publish()
     if removed == 0 and not existed:
         raise HTTPException(404, f"'{filename}' not found")
     return {"status": "deleted", "filename": filename, "chunks_removed": removed}
@@ -337,11 +1109,13 @@ def delete_excel(filename: str):
 # ── Reset everything ──
 @app.delete("/admin/reset")
 def reset_all():
-    global index, metadata_store, _id_counter
-    index          = _make_index()
-    metadata_store = {}
-    _id_counter    = 0
-    _save()
+    _wait_index()
+    with indexes.write():                   # after the write in progress; queries carry on meanwhile
+        fresh = _make_index()
+        metadata_store.clear()
+        store.reset(fresh)
+        indexes.publish(fresh)
+    query_cache.clear()                     # once the empty index is the one being searched
     for d in [PDF_DIR, EXCEL_DIR]:
         shutil.rmtree(d, ignore_errors=True)
         d.mkdir(parents=True, exist_ok=True)
@@ -364,54 +1138,187 @@ async def query_system(req: QueryRequest):
     if not machines:
         raise HTTPException(404, "No machines in knowledge base")
 
-    results = []
-    for machine in machines:
-        chunks = _retrieve(req.query, machine)
-        if not chunks:
-            continue
+    results = await run_in_threadpool(_query_results, req.query, machines)
+    return {"results": results}
 
-        manual_chunks = [c for c in chunks if c.get("source") == "manual"]
-        log_chunks    = [c for c in chunks if c.get("source") == "repair_log"]
-
-        context_parts = []
-        references    = []
-        seen_refs     = set()
-
-        for c in manual_chunks:
-            context_parts.append(
-                f"[MANUAL — Page {c.get('page_number', '?')} | {c.get('source_pdf', '')}]\n{c['text']}"
-            )
-            key = f"{c.get('source_pdf', '')}:{c.get('page_number', 1)}"
-            if key not in seen_refs:
-                seen_refs.add(key)
-                references.append({
-                    "pdf":  c.get("source_pdf", ""),
-                    "page": c.get("page_number", 1),
-                })
-
-        for c in log_chunks:
-            context_parts.append(f"[REPAIR LOG]\n{c['text']}")
-
-        results.append({
-            "machine":            machine,
-            "query":              req.query,
-            "context":            "\n\n---\n\n".join(context_parts),
-            "references":         references,
-            "manual_chunks_used": len(manual_chunks),
-            "log_chunks_used":    len(log_chunks),
-            "_chunks": [
-                {
-                    "text":        c.get("text", "")[:400],
-                    "score":       c.get("score", 0),
-                    "source":      c.get("source", "manual"),
-                    "page_number": c.get("page_number"),
-                    "source_pdf":  c.get("source_pdf", ""),
-                }
-                for c in chunks
-            ],
-        })
+def _query_results(query: str, machines: list) -> list:
+    """
+    Per-machine results, from the query cache where possible. Misses share
+    one query embedding (All Machines mode) and are cached under the corpus
+    version captured before retrieval.
+    """
+    _follow_writer()
+    versions = {m: query_cache.version(m) for m in machines}
+    out, todo = {}, []
+    for m in machines:
+        hit, res = query_cache.get(query, m, versions[m])
+        if hit:
+            out[m] = res
+        else:
+            todo.append(m)
+    if todo:
+        _wait_index()
+    snap = indexes.snapshot() if todo else None     # one index version for the whole query
+    if todo and snap.ntotal:
+        q_vec = _embed_query(query)
+        for m in todo:
+            hit, res = query_cache.get_similar(q_vec, m, versions[m])
+            if not hit:
+                res = _build_result(m, query, _retrieve_vec(snap, q_vec, m))
+                query_cache.put(query, m, versions[m], res, q_vec)
+            out[m] = res
+    return [dict(out[m], machine=m, query=query) for m in machines if out.get(m)]
 
-    return {"results": results}
+# ── Batch query ──
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+    format:  bool = False
+
+@app.post("/query/batch")
+async def query_batch(req: BatchQueryRequest):
+    """
+    Many questions in one call (regression sets, shift-handover reports).
+    NDJSON, one line per question as soon as its batch is retrieved — and
+    formatted, with format=true, in completion order:
+        {"type": "result", "index": i, "query": ..., "machine_name": ..., "results": [...]}
+    then {"type": "done", "queries": n, "took_ms": ...}.
+    """
+    items = [(q.query, q.machine_name) for q in req.queries]
+    if not items:
+        raise HTTPException(400, "No queries")
+    empty = [i for i, (q, _) in enumerate(items) if not q.strip()]
+    if empty:
+        raise HTTPException(400, f"Query cannot be empty (index {empty[0]})")
+
+    def line(i, results):
+        return json.dumps({"type": "result", "index": i, "query": items[i][0],
+                           "machine_name": items[i][1], "results": results}) + "\n"
+
+    async def lines():
+        t0 = time.perf_counter()
+        for start in range(0, len(items), QUERY_BATCH):
+            batch = await run_in_threadpool(_batch_results, items[start:start + QUERY_BATCH])
+            if not req.format:
+                for i, results in enumerate(batch, start):
+                    yield line(i, results)
+                continue
+            # A question's line goes out once all of its machines are formatted
+            flat = [(i, j) for i, results in enumerate(batch) for j in range(len(results))]
+            left = [len(results) for results in batch]
+            for i, results in enumerate(batch):
+                if not results:
+                    yield line(start + i, results)
+            async for n, text in _format_many([batch[i][j] for i, j in flat]):
+                i, j        = flat[n]
+                batch[i][j] = dict(batch[i][j], formatted=text)
+                left[i]    -= 1
+                if not left[i]:
+                    yield line(start + i, batch[i])
+        yield json.dumps({"type": "done", "queries": len(items),
+                          "took_ms": round((time.perf_counter() - t0) * 1000)}) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _batch_results(items: list) -> list:
+    """
+    [(query, machine_name)] → each item's /query results. Cache misses are
+    embedded in one encode call, and each machine's shards are searched once
+    with every question that needs them.
+    """
+    _follow_writer()
+    every = None
+    plan  = []
+    for _, m in items:
+        if m.lower() == "all":
+            every = _get_machines() if every is None else every
+            plan.append(every)
+        else:
+            plan.append([m])
+
+    versions, out, todo = {}, {}, {}       # todo: machine → distinct missed queries
+    for (q, _), machines in zip(items, plan):
+        for m in machines:
+            if (q, m) in out or q in todo.get(m, {}):
+                continue
+            if m not in versions:
+                versions[m] = query_cache.version(m)
+            hit, res = query_cache.get(q, m, versions[m])
+            if hit:
+                out[(q, m)] = res
+            else:
+                todo.setdefault(m, {})[q] = None
+
+    if todo:
+        _wait_index()
+    snap = indexes.snapshot() if todo else None
+    if todo and snap.ntotal:
+        texts = list(dict.fromkeys(q for qs in todo.values() for q in qs))
+        vecs  = dict(zip(texts, embed_cache.encode(texts)))
+        for m, qs in todo.items():
+            fresh = []
+            for q in qs:
+                hit, res = query_cache.get_similar(vecs[q], m, versions[m])
+                if hit:
+                    out[(q, m)] = res
+                else:
+                    fresh.append(q)
+            if not fresh:
+                continue
+            q_vecs = np.vstack([vecs[q] for q in fresh])
+            manual = _search_shards_many(snap, q_vecs, m, "manual",     5)
+            logs   = _search_shards_many(snap, q_vecs, m, "repair_log", 3)
+            for q, man, log in zip(fresh, manual, logs):
+                out[(q, m)] = _build_result(m, q, man + log)
+                query_cache.put(q, m, versions[m], out[(q, m)], vecs[q])
+
+    return [
+        [dict(out[(q, m)], machine=m, query=q) for m in machines if out.get((q, m))]
+        for (q, _), machines in zip(items, plan)
+    ]
+
+def _build_result(machine: str, query: str, chunks: list):
+    """Context, references and chunk inspector data for one machine. None if nothing relevant."""
+    if not chunks:
+        return None
+    manual_chunks = [c for c in chunks if c.get("source") == "manual"]
+    log_chunks    = [c for c in chunks if c.get("source") == "repair_log"]
+
+    context_parts = []
+    references    = []
+    seen_refs     = set()
+
+    for c in manual_chunks:
+        context_parts.append(
+            f"[MANUAL — Page {c.get('page_number', '?')} | {c.get('source_pdf', '')}]\n{c['text']}"
+        )
+        key = f"{c.get('source_pdf', '')}:{c.get('page_number', 1)}"
+        if key not in seen_refs:
+            seen_refs.add(key)
+            references.append({
+                "pdf":  c.get("source_pdf", ""),
+                "page": c.get("page_number", 1),
+            })
+
+    for c in log_chunks:
+        context_parts.append(f"[REPAIR LOG]\n{c['text']}")
+
+    return {
+        "machine":            machine,
+        "query":              query,
+        "context":            "\n\n---\n\n".join(context_parts),
+        "references":         references,
+        "manual_chunks_used": len(manual_chunks),
+        "log_chunks_used":    len(log_chunks),
+        "_chunks": [
+            {
+                "text":        c.get("text", "")[:400],
+                "score":       c.get("score", 0),
+                "source":      c.get("source", "manual"),
+                "page_number": c.get("page_number"),
+                "source_pdf":  c.get("source_pdf", ""),
+            }
+            for c in chunks
+        ],
+    }
 
 # ── Format ──
 class FormatRequest(BaseModel):
@@ -421,9 +1328,64 @@ class FormatRequest(BaseModel):
 
 @app.post("/format")
 async def format_response(req: FormatRequest):
-    formatted = generate_formatted_response(req.context, req.query, req.machine)
+    # Fully async: waiting on the LLM holds no worker thread
+    formatted = await agenerate_formatted_response(req.context, req.query, req.machine)
     return {"formatted": formatted}
 
+@app.post("/format/stream")
+async def format_stream(req: FormatRequest):
+    """NDJSON: token events as the LLM generates, then one done event with the full answer."""
+    async def lines():
+        async for e in stream_formatted_response(req.context, req.query, req.machine):
+            yield json.dumps(e) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+class FormatBatchRequest(BaseModel):
+    items: List[FormatRequest]
+
+@app.post("/format/batch")
+async def format_batch(req: FormatBatchRequest):
+    """
+    Several answers in one call — e.g. one per machine for an All Machines
+    query — at most FORMAT_CONCURRENCY generating at once. NDJSON in
+    completion order:
+        {"type": "result", "index": i, "machine": ..., "formatted": ...}
+    then {"type": "done", "count": n, "took_ms": ...}.
+    """
+    if not req.items:
+        raise HTTPException(400, "No items")
+
+    async def lines():
+        t0 = time.perf_counter()
+        async for i, text in _format_many(
+            [{"context": it.context, "query": it.query, "machine": it.machine} for it in req.items]
+        ):
+            yield json.dumps({"type": "result", "index": i, "machine": req.items[i].machine,
+                              "formatted": text}) + "\n"
+        yield json.dumps({"type": "done", "count": len(req.items),
+                          "took_ms": round((time.perf_counter() - t0) * 1000)}) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def _format_many(items: list):
+    """Yield (index, formatted) for dicts with context/query/machine as each answer completes."""
+    slots = asyncio.Semaphore(FORMAT_CONCURRENCY)
+
+    async def one(i, it):
+        async with slots:
+            return i, await agenerate_formatted_response(it["context"], it["query"], it["machine"])
+
+    tasks = [asyncio.ensure_future(one(i, it)) for i, it in enumerate(items)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
+
+@app.on_event("shutdown")
+async def _close_llm_clients():
+    await llm_pool.aclose()
+
 # ── Info ──
 @app.get("/admin/machines")
 def list_machines():
@@ -432,9 +1394,16 @@ def list_machines():
 @app.get("/admin/stats")
 def get_stats():
     return {
-        "total_chunks": index.ntotal,
-        "machines":     _get_machines(),
-        "files":        _get_files(),
+        "total_chunks":  _chunk_count(),
+        "index_version": indexes.version,
+        "machines":      _get_machines(),
+        "kb_version":    _kb_version(),     # after _get_machines(), which follows the writer
+        "files":         _get_files(),
+        "embed_engine":  EMBED_ENGINE,
+        "embed_cache":   embed_cache.stats(),
+        "query_cache":   query_cache.stats(),
+        "llm_cache":     llm_cache_stats(),
+        "llm_backends":  backend_stats(),
     }
 
 @app.get("/pdf/{filename}")
@@ -446,4 +1415,16 @@ def serve_pdf(filename: str):
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "chunks_indexed": index.ntotal}
+    """Liveness: answers as soon as the process is up, even while the index and model load."""
+    return {"status": "ok", "ready": _ready(), "chunks_indexed": _chunk_count()}
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once the index is open and the embedder loaded, 503 with progress until then."""
+    body = dict(_startup, ready=_ready(), role=ROLE, generation=_generation["seq"])
+    if _embedder is not None:
+        body["embedder"] = "ready"          # may have loaded lazily after a failed warm-up
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+def _ready() -> bool:
+    return indexes.snapshot() is not None and _embedder is not None
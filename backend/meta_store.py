@@ -0,0 +1,294 @@
+"""
+IndustrialRAG - Chunk Metadata Store
+SQLite on disk, keyed by vector id. Hot fields live in `chunks` (indexed by
+machine and source file); chunk text lives in `chunk_text` and is only read
+for the hits a query actually returns. A per-file summary (`files`) is kept
+in step with every write and cached in memory for the listing endpoints.
+Every chunk carries a hash of its text, so a re-upload can keep the vectors
+of chunks that did not change.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+
+HOT = ("machine_name", "source", "source_pdf", "source_excel", "page_number", "log_id")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id           INTEGER PRIMARY KEY,
+    machine_name TEXT NOT NULL,
+    source       TEXT NOT NULL,
+    source_pdf   TEXT,
+    source_excel TEXT,
+    page_number  INTEGER,
+    log_id       TEXT,
+    extra        TEXT,
+    hash         TEXT
+);
+CREATE TABLE IF NOT EXISTS chunk_text (
+    id   INTEGER PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    filename     TEXT PRIMARY KEY,
+    type         TEXT NOT NULL,
+    machine_name TEXT NOT NULL,
+    chunks       INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    filename TEXT PRIMARY KEY,
+    sha256   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_chunks_machine ON chunks(machine_name);
+CREATE INDEX IF NOT EXISTS ix_chunks_pdf     ON chunks(source_pdf)   WHERE source_pdf   IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_chunks_excel   ON chunks(source_excel) WHERE source_excel IS NOT NULL;
+"""
+
+
+SCHEMA_VERSION = 3   # 2: files summary table  3: chunk content hashes + file hashes
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class MetaStore:
+    """Chunk metadata by vector id. Safe to share across threads."""
+
+    def __init__(self, path: Path):
+        self.path      = path
+        self._lock     = threading.Lock()
+        self._db       = sqlite3.connect(str(path), check_same_thread=False)
+        self._files    = {}          # filename → {"filename", "machine", "type", "chunks"}
+        self._machines = Counter()   # machine_name → number of files
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            self._migrate(version)
+        self.reload()
+
+    def reload(self):
+        """Re-read the file summary from disk — for processes that share the database with a writer."""
+        with self._lock:
+            self._files.clear()
+            self._machines.clear()
+            for f, kind, machine, n in self._db.execute(
+                "SELECT filename, type, machine_name, chunks FROM files ORDER BY rowid"
+            ):
+                self._cache_file(f, kind, machine, n)
+
+    def _migrate(self, version: int):
+        cols = [r[1] for r in self._db.execute("PRAGMA table_info(chunks)")]
+        with self._db:
+            if "hash" not in cols:
+                self._db.execute("ALTER TABLE chunks ADD COLUMN hash TEXT")
+                self._db.executemany(
+                    "UPDATE chunks SET hash = ? WHERE id = ?",
+                    ((text_hash(t), i) for i, t in self._db.execute("SELECT id, text FROM chunk_text").fetchall()),
+                )
+            if version < 2:
+                # One-off backfill of the summary for databases written before it existed
+                self._db.execute("DELETE FROM files")
+                self._db.execute(
+                    "INSERT INTO files SELECT source_pdf, 'pdf', MIN(machine_name), COUNT(*) "
+                    "FROM chunks WHERE source_pdf IS NOT NULL GROUP BY source_pdf ORDER BY MIN(id)"
+                )
+                self._db.execute(
+                    "INSERT OR IGNORE INTO files SELECT source_excel, 'excel', MIN(machine_name), COUNT(*) "
+                    "FROM chunks WHERE source_excel IS NOT NULL GROUP BY source_excel ORDER BY MIN(id)"
+                )
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # ── Writes ──
+    def reserve_ids(self, n: int, floor: int = 0) -> int:
+        """
+        First of `n` fresh consecutive vector ids, at least `floor`. Taken in
+        one write transaction, so threads and processes sharing the database
+        never get the same id.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row   = self._db.execute("SELECT value FROM counters WHERE name = 'next_id'").fetchone()
+                top   = self._db.execute("SELECT MAX(id) FROM chunks").fetchone()[0]
+                start = max(row[0] if row else 0, -1 if top is None else top + 1, floor)
+                self._db.execute("INSERT OR REPLACE INTO counters VALUES ('next_id', ?)", (start + n,))
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        return start
+
+    def add(self, ids: list, metas: list, replace: bool = True):
+        """Insert one upload's chunks in a single transaction."""
+        verb  = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        hot   = []
+        texts = []
+        for vid, meta in zip(ids, metas):
+            extra = {k: v for k, v in meta.items() if k not in HOT and k != "text"}
+            hot.append((int(vid), meta.get("machine_name", ""), meta.get("source", "manual"),
+                        meta.get("source_pdf"), meta.get("source_excel"),
+                        meta.get("page_number"), meta.get("log_id"),
+                        json.dumps(extra) if extra else None, text_hash(meta.get("text", ""))))
+            texts.append((int(vid), meta.get("text", "")))
+        touched = {_file_of(m) for m in metas} - {None}
+        with self._lock, self._db:
+            self._db.executemany(f"{verb} INTO chunks VALUES (?,?,?,?,?,?,?,?,?)", hot)
+            self._db.executemany(f"{verb} INTO chunk_text VALUES (?,?)", texts)
+            self._refresh_files(touched)
+
+    def remove(self, ids: list):
+        rows = [(int(v),) for v in ids]
+        with self._lock, self._db:
+            touched = self._files_of(rows)
+            self._db.executemany("DELETE FROM chunks WHERE id = ?", rows)
+            self._db.executemany("DELETE FROM chunk_text WHERE id = ?", rows)
+            self._refresh_files(touched)
+
+    def remove_above(self, max_id: int) -> int:
+        """Drop rows whose vectors were never logged (crash between the two writes)."""
+        with self._lock, self._db:
+            rows    = self._db.execute("SELECT id FROM chunks WHERE id > ?", (max_id,)).fetchall()
+            touched = self._files_of(rows)
+            n = self._db.execute("DELETE FROM chunks WHERE id > ?", (max_id,)).rowcount
+            self._db.execute("DELETE FROM chunk_text WHERE id > ?", (max_id,))
+            self._refresh_files(touched)
+        return n
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM chunks")
+            self._db.execute("DELETE FROM chunk_text")
+            self._db.execute("DELETE FROM files")
+            self._db.execute("DELETE FROM file_hashes")
+            # counters stay: ids are never reused, old snapshots may still be searched
+            self._files.clear()
+            self._machines.clear()
+
+    # ── File summary ──
+    def _files_of(self, id_rows: list) -> set:
+        touched = set()
+        for i in range(0, len(id_rows), 500):
+            batch = [r[0] for r in id_rows[i:i + 500]]
+            touched.update(self._db.execute(
+                "SELECT DISTINCT source_pdf, source_excel FROM chunks "
+                f"WHERE id IN ({','.join('?' * len(batch))})", batch,
+            ).fetchall())
+        return {_file_of({"source_pdf": p, "source_excel": e}) for p, e in touched} - {None}
+
+    def _refresh_files(self, touched: set):
+        """Recount only the affected files, via the per-file indexes. Caller holds the lock."""
+        for name, kind in touched:
+            col        = "source_pdf" if kind == "pdf" else "source_excel"
+            n, machine = self._db.execute(
+                f"SELECT COUNT(*), MIN(machine_name) FROM chunks WHERE {col} = ?", (name,)
+            ).fetchone()
+            self._uncache_file(name)
+            if n:
+                self._db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)", (name, kind, machine, n))
+                self._cache_file(name, kind, machine, n)
+            else:
+                self._db.execute("DELETE FROM files WHERE filename = ?", (name,))
+                self._db.execute("DELETE FROM file_hashes WHERE filename = ?", (name,))
+
+    def _cache_file(self, name: str, kind: str, machine: str, n: int):
+        self._files[name] = {"filename": name, "machine": machine, "type": kind, "chunks": n}
+        self._machines[machine] += 1
+
+    def _uncache_file(self, name: str):
+        old = self._files.pop(name, None)
+        if old:
+            self._machines[old["machine"]] -= 1
+            if self._machines[old["machine"]] <= 0:
+                del self._machines[old["machine"]]
+
+    # ── Reads ──
+    def get_many(self, ids) -> dict:
+        """Full metadata (including text) for the given ids. Missing ids are omitted."""
+        ids = [int(v) for v in ids]
+        if not ids:
+            return {}
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT c.id, c.machine_name, c.source, c.source_pdf, c.source_excel, "
+                f"c.page_number, c.log_id, c.extra, t.text "
+                f"FROM chunks c JOIN chunk_text t ON t.id = c.id WHERE c.id IN ({marks})",
+                ids,
+            ).fetchall()
+        return {r[0]: _row_to_meta(r) for r in rows}
+
+    def ids_for_source(self, source_pdf=None, source_excel=None) -> list:
+        """[(id, machine_name, source)] for every chunk of one file."""
+        col, name = ("source_pdf", source_pdf) if source_pdf else ("source_excel", source_excel)
+        if not name:
+            return []
+        with self._lock:
+            return self._db.execute(
+                f"SELECT id, machine_name, source FROM chunks WHERE {col} = ?", (name,)
+            ).fetchall()
+
+    def hashes_for_source(self, source_pdf=None, source_excel=None) -> list:
+        """[(id, machine_name, source, content hash)] for every chunk of one file."""
+        col, name = ("source_pdf", source_pdf) if source_pdf else ("source_excel", source_excel)
+        if not name:
+            return []
+        with self._lock:
+            return self._db.execute(
+                f"SELECT id, machine_name, source, hash FROM chunks WHERE {col} = ?", (name,)
+            ).fetchall()
+
+    def file_hash(self, filename: str):
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM file_hashes WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def set_file_hash(self, filename: str, sha256: str):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO file_hashes VALUES (?,?)", (filename, sha256))
+
+    def machines(self) -> list:
+        with self._lock:
+            return sorted(self._machines)
+
+    def files(self) -> list:
+        with self._lock:
+            return [dict(f) for f in self._files.values()]
+
+    def max_id(self) -> int:
+        with self._lock:
+            v = self._db.execute("SELECT MAX(id) FROM chunks").fetchone()[0]
+        return -1 if v is None else v
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def _file_of(meta: dict):
+    if meta.get("source_pdf"):
+        return (meta["source_pdf"], "pdf")
+    if meta.get("source_excel"):
+        return (meta["source_excel"], "excel")
+    return None
+
+
+def _row_to_meta(r) -> dict:
+    meta = {"machine_name": r[1], "source": r[2]}
+    for k, v in zip(("source_pdf", "source_excel", "page_number", "log_id"), r[3:7]):
+        if v is not None:
+            meta[k] = v
+    if r[7]:
+        meta.update(json.loads(r[7]))
+    meta["text"] = r[8]
+    return meta
@@ -0,0 +1,285 @@
+"""
+IndustrialRAG - Parallel OCR for scanned PDF pages
+Pages with no extractable text are rendered and recognised in a process pool
+(one tesseract per core) while the upload keeps parsing the remaining pages.
+Page text (native extraction and OCR) is cached in SQLite by a hash of the
+page's raw content and fonts, so a re-upload of the same manual skips every
+page it has already read.
+
+Kept free of heavy imports: spawned pool workers import this module only.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", str(os.cpu_count() or 1)))   # 0 = OCR in the upload thread
+OCR_DPI     = int(os.environ.get("OCR_DPI", "300"))
+OCR_CACHE   = int(os.environ.get("OCR_CACHE_PAGES", "20000"))   # page texts kept on disk, 0 = no cache
+
+
+# ── Page hashing ──
+def page_hash(page):
+    """
+    sha1 over what determines the page's text: content streams, fonts (their
+    encodings, ToUnicode maps and embedded programs decide what the glyph
+    codes read as), XObjects (scanned images, forms with their own fonts),
+    size and rotation. None if the page can't be read.
+    """
+    from pdfminer.pdftypes import resolve1
+    try:
+        obj = page.page_obj
+        h   = hashlib.sha1(f"{page.width}x{page.height}|{obj.rotate}".encode())
+        for stream in obj.contents:
+            h.update(resolve1(stream).get_rawdata() or b"")
+        resources = resolve1(obj.resources) or {}
+        for name in ("Font", "XObject"):
+            h.update(name.encode())
+            _digest(h, resources.get(name), set())
+        return h.hexdigest()
+    except Exception:
+        return None
+
+def _digest(h, obj, seen: set):
+    """Feed a PDF object graph into `h`: dicts in key order, streams with their data, each reference once."""
+    from pdfminer.pdftypes import PDFObjRef, PDFStream
+    if isinstance(obj, PDFObjRef):
+        if obj.objid in seen:
+            h.update(f"@{obj.objid}".encode())
+            return
+        seen.add(obj.objid)
+        obj = obj.resolve()
+    if isinstance(obj, PDFStream):
+        _digest(h, obj.attrs, seen)
+        h.update(obj.get_rawdata() or b"")
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            h.update(f"/{key}".encode())
+            _digest(h, obj[key], seen)
+    elif isinstance(obj, list):
+        h.update(b"[")
+        for item in obj:
+            _digest(h, item, seen)
+        h.update(b"]")
+    else:
+        h.update(repr(obj).encode())
+
+
+# ── Worker side ──
+_worker_pdf = None   # (path, pdfplumber.PDF) — each worker keeps the file it's on open
+
+def _recognise(page, dpi: int) -> str:
+    import pytesseract
+    img = page.to_image(resolution=dpi).original
+    return pytesseract.image_to_string(img)
+
+def _ocr_task(path: str, page_index: int, dpi: int) -> str:
+    global _worker_pdf
+    import pdfplumber
+    if _worker_pdf is None or _worker_pdf[0] != path:
+        if _worker_pdf is not None:
+            _worker_pdf[1].close()
+        _worker_pdf = (path, pdfplumber.open(path))
+    return _recognise(_worker_pdf[1].pages[page_index], dpi)
+
+def _init_worker():
+    # One page per process; stop tesseract's own OpenMP threads oversubscribing the cores
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+# ── Cache ──
+class PageCache:
+    """
+    Page text by page hash (OCR results are keyed "<hash>@<dpi>"). Safe to
+    share across threads. Holds at most max_pages, dropping the least
+    recently used. `used` is a use counter; a hit only writes it back when
+    the page is in the older half, so re-reading recent pages stays read-only.
+    """
+
+    def __init__(self, path: Path, max_pages: int = None):
+        self.max_pages = OCR_CACHE if max_pages is None else max_pages
+        self._lock     = threading.Lock()
+        self._db       = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS pages (hash TEXT PRIMARY KEY, text TEXT NOT NULL)")
+            if "used" not in [c[1] for c in self._db.execute("PRAGMA table_info(pages)")]:
+                self._db.execute("ALTER TABLE pages ADD COLUMN used INTEGER NOT NULL DEFAULT 0")
+                self._db.execute("UPDATE pages SET used = rowid")    # caches from before: write order
+            self._db.execute("CREATE INDEX IF NOT EXISTS pages_used ON pages (used)")
+            self._n, self._tick = self._db.execute("SELECT COUNT(*), COALESCE(MAX(used), 0) FROM pages").fetchone()
+            self._trim()                # the cap may have been lowered since the last run
+
+    def get(self, key: str):
+        if self.max_pages <= 0:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT text, used FROM pages WHERE hash = ?", (key,)).fetchone()
+            if row and row[1] <= self._tick - self.max_pages // 2:
+                with self._db:
+                    self._tick += 1
+                    self._db.execute("UPDATE pages SET used = ? WHERE hash = ?", (self._tick, key))
+        return row[0] if row else None
+
+    def put(self, key: str, text: str):
+        if self.max_pages <= 0:
+            return
+        with self._lock, self._db:
+            known = self._db.execute("SELECT 1 FROM pages WHERE hash = ?", (key,)).fetchone()
+            self._tick += 1
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?,?,?)", (key, text, self._tick))
+            self._n += 0 if known else 1
+            self._trim()
+
+    def _trim(self):
+        """Drop the least recently used pages over the cap. Caller holds the lock."""
+        if self._n > self.max_pages:
+            self._db.execute(
+                "DELETE FROM pages WHERE hash IN (SELECT hash FROM pages ORDER BY used LIMIT ?)",
+                (self._n - self.max_pages,),
+            )
+            self._n = self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+
+# ── Pipeline ──
+class PageOCR:
+    """Shared process pool + cache. Call run(path) once per PDF being ingested."""
+
+    def __init__(self, cache_path: Path, workers: int = None, dpi: int = None):
+        self.cache     = PageCache(cache_path)
+        self.workers   = OCR_WORKERS if workers is None else workers
+        self.dpi       = dpi or OCR_DPI
+        self._pool     = None
+        self._lock     = threading.Lock()
+        self.available = _tesseract_available()
+        if not self.available:
+            print("WARNING: pytesseract/tesseract not installed — scanned PDF pages will be skipped.")
+
+    def pool(self):
+        # Started on first use; spawn, because the parent holds torch/FAISS threads
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    def reset_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def text_layer(self, page):
+        """(native text, page hash). The text comes from the cache when this exact page was read before."""
+        key  = page_hash(page)
+        text = self.cache.get(key) if key else None
+        if text is None:
+            text = (page.extract_text() or "").strip()
+            if key:
+                self.cache.put(key, text)
+        return text, key
+
+    def run(self, path: Path):
+        return OcrRun(self, str(path))
+
+
+class OcrRun:
+    """
+    OCR for the scanned pages of one PDF. add() each page as the parser reaches
+    it; finished() hands over the pages done so far without waiting, and
+    results() the rest, both as (page_num, text) in completion order. A page
+    whose OCR fails comes back with empty text.
+    """
+
+    def __init__(self, ocr: PageOCR, path: str):
+        self.ocr     = ocr
+        self.path    = path
+        self.ready   = []     # (page_num, text) known but not handed over yet
+        self.futures = {}     # future → (page_num, hash), still running or not handed over
+        self.pages   = 0
+        self.hits    = 0
+
+    def __len__(self):
+        return self.pages
+
+    def add(self, page_num: int, page, key: str = None) -> bool:
+        """Queue a page. False if it will not come back: no tesseract, or OCR in this thread failed."""
+        if not self.ocr.available:
+            return False
+        self.pages += 1
+        key = key or page_hash(page)
+        if key is not None:
+            key = f"{key}@{self.ocr.dpi}"
+            text = self.ocr.cache.get(key)
+            if text is not None:
+                self.hits += 1
+                self.ready.append((page_num, text))
+                return True
+        if self.ocr.workers <= 0:
+            try:
+                text = _recognise(page, self.ocr.dpi)
+            except Exception as e:
+                print(f"WARNING: OCR failed on page {page_num} of {Path(self.path).name} ({e})")
+                return False
+            self.ready.append((page_num, self._finish(key, text)))
+            return True
+        fut = self.ocr.pool().submit(_ocr_task, self.path, page_num - 1, self.ocr.dpi)
+        self.futures[fut] = (page_num, key)
+        return True
+
+    def finished(self):
+        """Yield the pages done so far, each only once."""
+        ready, self.ready = self.ready, []
+        yield from ready
+        for fut in [f for f in self.futures if f.done()]:
+            yield self._collect(fut)
+
+    def results(self, check=None):
+        """Yield the remaining pages as they finish. `check` runs between results and may raise to abort."""
+        try:
+            yield from self.finished()
+            while self.futures:
+                if check:
+                    check()
+                done, _ = wait(self.futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield self._collect(fut)
+        finally:
+            self.cancel()
+
+    def _collect(self, fut):
+        page_num, key = self.futures.pop(fut)
+        try:
+            return page_num, self._finish(key, fut.result())
+        except Exception as e:
+            print(f"WARNING: OCR failed on page {page_num} of {Path(self.path).name} ({e})")
+            if isinstance(e, BrokenProcessPool):
+                self.ocr.reset_pool()
+            return page_num, ""
+
+    def cancel(self):
+        for fut in self.futures:
+            fut.cancel()
+
+    def _finish(self, key, text: str) -> str:
+        text = text or ""
+        if key is not None:
+            self.ocr.cache.put(key, text)
+        return text
+
+
+def _tesseract_available() -> bool:
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,111 @@
+"""
+IndustrialRAG - Query Result Cache
+Per-machine /query results keyed by (normalised query, machine, corpus
+version). Each machine's version is bumped whenever its chunks change, so an
+upload, delete or reset never serves a stale answer. Optionally a query whose
+embedding is close enough to a cached one reuses that result too.
+"""
+
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "2000"))     # machine results held, 0 = off
+QUERY_CACHE_SIM  = float(os.environ.get("QUERY_CACHE_SIM", "0"))       # e.g. 0.97 — also match rephrasings; 0 = exact only
+
+
+def normalise(query: str) -> str:
+    return " ".join(query.casefold().split()).strip(" ?!.")
+
+
+class QueryCache:
+    """LRU of per-machine results. Safe to share across threads."""
+
+    def __init__(self, size: int = None, sim: float = None):
+        self.size      = QUERY_CACHE_SIZE if size is None else size
+        self.sim       = QUERY_CACHE_SIM if sim is None else sim
+        self._entries  = OrderedDict()        # (query, machine, version) → (result, q_vec)
+        self._by_mach  = defaultdict(set)     # machine → keys, for invalidation and similarity scans
+        self._versions = defaultdict(int)     # machine → corpus version
+        self._lock     = threading.Lock()
+        self._stats    = {"hits": 0, "similar_hits": 0, "misses": 0, "invalidations": 0}
+
+    def version(self, machine: str) -> int:
+        """Capture before retrieving; pass the same value to put()."""
+        with self._lock:
+            return self._versions[machine.lower()]
+
+    def get(self, query: str, machine: str, version: int):
+        """(hit, result). A cached result may be None: that machine had no relevant chunks."""
+        if self.size <= 0:
+            return False, None
+        key = (normalise(query), machine.lower(), version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, entry[0]
+
+    def get_similar(self, q_vec, machine: str, version: int):
+        """(hit, result) from the closest cached query for this machine, if above QUERY_CACHE_SIM."""
+        if self.size <= 0 or self.sim <= 0:
+            self._count_miss()
+            return False, None
+        machine = machine.lower()
+        with self._lock:
+            keys = [k for k in self._by_mach[machine] if k[2] == version and self._entries[k][1] is not None]
+            if keys:
+                sims = np.vstack([self._entries[k][1] for k in keys]) @ np.asarray(q_vec).reshape(-1)
+                best = int(np.argmax(sims))
+                if sims[best] >= self.sim:
+                    self._entries.move_to_end(keys[best])
+                    self._stats["similar_hits"] += 1
+                    return True, self._entries[keys[best]][0]
+            self._stats["misses"] += 1
+        return False, None
+
+    def put(self, query: str, machine: str, version: int, result, q_vec=None):
+        if self.size <= 0:
+            return
+        machine = machine.lower()
+        key     = (normalise(query), machine, version)
+        with self._lock:
+            if version != self._versions[machine]:
+                return                        # corpus changed while we were retrieving
+            self._entries[key] = (result, None if q_vec is None else np.asarray(q_vec).reshape(-1))
+            self._entries.move_to_end(key)
+            self._by_mach[machine].add(key)
+            while len(self._entries) > self.size:
+                old, _ = self._entries.popitem(last=False)
+                self._by_mach[old[1]].discard(old)
+
+    def invalidate(self, machines):
+        """Call after a machine's chunks change (upload, delete)."""
+        with self._lock:
+            for machine in {m.lower() for m in machines}:
+                self._versions[machine] += 1
+                for key in self._by_mach.pop(machine, ()):
+                    self._entries.pop(key, None)
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            for machine in list(self._versions) + list(self._by_mach):
+                self._versions[machine] += 1
+            self._entries.clear()
+            self._by_mach.clear()
+
+    def _count_miss(self):
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats, entries=len(self._entries))
+        lookups = s["hits"] + s["similar_hits"] + s["misses"]
+        s["hit_rate"] = round((s["hits"] + s["similar_hits"]) / lookups, 3) if lookups else 0.0
+        return s
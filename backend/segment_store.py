@@ -0,0 +1,247 @@
+"""
+IndustrialRAG - Append-only Persistence
+Vector uploads and deletes are appended to a write-ahead log; a compacted
+snapshot is written only every WAL_COMPACT_OPS changes. Chunk metadata lives
+in meta_store (SQLite), which is durable on its own.
+
+Layout under vectorstore/:
+    CURRENT                  {"seq": N, "dir": "snapshots/0000000N", "max_id": …}
+    snapshots/0000000N/      shards/ as of change N
+    wal.log                  one JSON record per change after the checkpoint
+    segments/seg_<seq>.npy   vectors for each "add" record
+"""
+
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from meta_store import MetaStore
+from vector_index import ShardedIndex, shard_key
+
+WAL_COMPACT_OPS = int(os.environ.get("WAL_COMPACT_OPS", "50"))
+WAL_COMPACT_MB  = int(os.environ.get("WAL_COMPACT_MB", "256"))
+
+
+def _fsync_write(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fsync_path(path: Path):
+    """fsync a file, or a directory so the entries created or renamed in it survive a power loss."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SegmentStore:
+    """
+    Crash-safe persistence for a ShardedIndex.
+
+    A change is durable once its WAL line is fsynced; segment files are
+    written first, so a torn tail line is simply ignored on replay.
+    Compaction writes a fresh snapshot directory (unchanged shard files are
+    hard-linked from the previous one), then flips CURRENT atomically.
+    """
+
+    def __init__(self, root: Path):
+        self.root     = root
+        self.snap_dir = root / "snapshots"
+        self.seg_dir  = root / "segments"
+        self.wal_path = root / "wal.log"
+        self.current  = root / "CURRENT"
+        self.seq      = 0        # last change written
+        self.base     = 0        # seq of the checkpoint
+        self.pending  = 0        # WAL records since the checkpoint
+        self.max_id   = -1       # highest vector id ever logged
+        self._lock    = threading.Lock()
+        for d in [self.snap_dir, self.seg_dir]:
+            d.mkdir(parents=True, exist_ok=True)
+
+    def exists(self) -> bool:
+        return self.current.exists()
+
+    # ── Recovery ──
+    def load(self, dim: int, meta: MetaStore) -> ShardedIndex:
+        """
+        Open the last checkpoint and replay the WAL on top. Checkpoints and
+        records written before metadata moved to SQLite carry their metadata
+        inline; it is imported into `meta` on the way.
+        """
+        cp        = json.loads(self.current.read_text())
+        snap      = self.root / cp["dir"]
+        index     = ShardedIndex.read(snap / "shards")
+        index.dim = index.dim or dim
+        legacy_meta = (snap / "metadata.pkl").exists()
+        if legacy_meta:
+            with open(snap / "metadata.pkl", "rb") as f:
+                legacy = pickle.load(f)
+            meta.add(list(legacy), list(legacy.values()), replace=False)
+        self.base   = self.seq = cp["seq"]
+        self.max_id = cp.get("max_id", meta.max_id())
+
+        replayed = 0
+        for rec in self._records():
+            if rec["seq"] <= self.base:
+                continue
+            ids = rec["ids"]
+            if "metas" in rec:
+                keys = [_key(m) for m in rec["metas"]]
+                if rec["op"] == "add":
+                    meta.add(ids, rec["metas"], replace=False)
+            elif "keys" in rec:
+                keys = [tuple(k) for k in rec["keys"]]
+            else:
+                found = meta.get_many(ids)
+                ids   = [vid for vid in ids if vid in found]
+                keys  = [_key(found[vid]) for vid in ids]
+            if rec["op"] == "add":
+                vecs = np.load(self.seg_dir / f"seg_{rec['seq']:08d}.npy", mmap_mode="r")
+                index.add(np.asarray(vecs), ids, keys)
+                self.max_id = max([self.max_id] + ids)
+            elif rec["op"] == "remove":
+                index.remove(ids, keys)
+                meta.remove(ids)
+            self.seq  = rec["seq"]
+            replayed += 1
+        self.pending = replayed
+        if replayed:
+            print(f"Replayed {replayed} WAL records on top of checkpoint {self.base}")
+        if legacy_meta:
+            self.compact(index)        # next checkpoint no longer carries metadata.pkl
+        return index
+
+    def _records(self):
+        if not self.wal_path.exists():
+            return
+        with open(self.wal_path, "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print("WARNING: Torn WAL tail ignored.")
+                    return
+
+    # ── Append ──
+    def append_add(self, vecs, ids: list, keys: list):
+        with self._lock:
+            self.seq += 1
+            seg = self.seg_dir / f"seg_{self.seq:08d}.npy"
+            with open(seg, "wb") as f:
+                np.save(f, np.asarray(vecs, dtype="float32"))
+                f.flush()
+                os.fsync(f.fileno())
+            _fsync_path(self.seg_dir)
+            self._append({"op": "add", "seq": self.seq, "ids": [int(i) for i in ids], "keys": keys})
+            self.max_id = max([self.max_id] + [int(i) for i in ids])
+
+    def append_remove(self, ids: list, keys: list):
+        with self._lock:
+            self.seq += 1
+            self._append({"op": "remove", "seq": self.seq, "ids": [int(i) for i in ids], "keys": keys})
+
+    def _append(self, rec: dict):
+        created = not self.wal_path.exists()
+        with open(self.wal_path, "ab") as f:
+            f.write((json.dumps(rec) + "\n").encode())
+            f.flush()
+            os.fsync(f.fileno())
+        if created:
+            _fsync_path(self.root)
+        self.pending += 1
+
+    def needs_compaction(self) -> bool:
+        if self.pending >= WAL_COMPACT_OPS:
+            return True
+        size = self.wal_path.stat().st_size if self.wal_path.exists() else 0
+        size += sum(p.stat().st_size for p in self.seg_dir.glob("seg_*.npy"))
+        return size >= WAL_COMPACT_MB * 1024 * 1024
+
+    # ── Compaction ──
+    def compact(self, index: ShardedIndex):
+        """Checkpoint the in-memory index as a new snapshot, then drop the WAL and segments."""
+        with self._lock:
+            prev      = self._current_dir()
+            self.seq += 1          # each checkpoint gets its own directory
+            snap      = self.snap_dir / f"{self.seq:08d}"
+            tmp       = self.snap_dir / f"{self.seq:08d}.tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+
+            index.write(tmp / "shards", base=prev / "shards" if prev else None)
+            for f in (tmp / "shards").iterdir():
+                _fsync_path(f)
+            _fsync_path(tmp / "shards")
+            _fsync_path(tmp)
+            os.replace(tmp, snap)
+            _fsync_path(self.snap_dir)
+            _fsync_write(self.current, json.dumps({
+                "seq": self.seq, "dir": str(snap.relative_to(self.root)), "max_id": self.max_id,
+            }).encode())
+            _fsync_path(self.root)
+
+            # Checkpoint is durable — everything before it can go
+            self.wal_path.unlink(missing_ok=True)
+            for seg in self.seg_dir.glob("seg_*.npy"):
+                seg.unlink(missing_ok=True)
+            # The previous checkpoint stays until the next one, for readers still opening it
+            for old in self.snap_dir.iterdir():
+                if old not in (snap, prev):
+                    shutil.rmtree(old, ignore_errors=True)
+            self.base    = self.seq
+            self.pending = 0
+
+    def reset(self, index: ShardedIndex):
+        """
+        Checkpoint an emptied index. max_id is kept: a snapshot or reader
+        generation from before the reset must never find its old ids on new chunks.
+        """
+        self.compact(index)
+
+    # ── Readers ──
+    def checkpoint_seq(self):
+        """seq of the current checkpoint, or None. Cheap enough to poll."""
+        try:
+            return json.loads(self.current.read_text())["seq"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def open_snapshot(self, dim: int):
+        """
+        (seq, index) for the current checkpoint, memory-mapped read-only, for
+        processes that serve queries while another one writes. Published
+        shard files never change and are hard-linked between checkpoints, so
+        all readers and successive generations share their pages.
+        """
+        for _ in range(10):
+            try:
+                cp    = json.loads(self.current.read_text())
+                index = ShardedIndex.read(self.root / cp["dir"] / "shards", mmap=True)
+            except (OSError, ValueError, RuntimeError):
+                time.sleep(0.05)           # superseded and removed while we were opening it
+                continue
+            index.dim = index.dim or dim
+            return cp["seq"], index
+        raise RuntimeError("Checkpoint kept changing while being opened")
+
+    def _current_dir(self):
+        if not self.current.exists():
+            return None
+        d = self.root / json.loads(self.current.read_text())["dir"]
+        return d if d.exists() else None
+
+
+def _key(meta: dict) -> tuple:
+    return shard_key(meta.get("machine_name", ""), meta.get("source", "manual"))
@@ -0,0 +1,428 @@
+"""
+IndustrialRAG - Vector Index Layer
+Pluggable FAISS storage behind one small interface: flat (exact), HNSW or IVF-PQ.
+"""
+
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+# ── Config ──
+INDEX_TYPE     = os.environ.get("INDEX_TYPE", "flat").lower()   # flat | hnsw | ivfpq
+HNSW_M         = int(os.environ.get("HNSW_M", "32"))
+HNSW_EF_BUILD  = int(os.environ.get("HNSW_EF_BUILD", "80"))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "64"))
+IVF_NLIST      = int(os.environ.get("IVF_NLIST", "0"))          # 0 = auto (~4·√n)
+IVF_NPROBE     = int(os.environ.get("IVF_NPROBE", "16"))
+IVF_TRAIN_MIN  = int(os.environ.get("IVF_TRAIN_MIN", "10000"))  # stay flat until this many vectors
+PQ_M           = int(os.environ.get("PQ_M", "48"))              # sub-quantizers, must divide dim
+IVF_RERANK     = int(os.environ.get("IVF_RERANK", "8"))         # IVF-PQ candidates per result, re-ranked on exact vectors
+
+KINDS    = ("flat", "hnsw", "ivfpq")
+PQ_NBITS = 8    # 256 centroids per sub-quantizer, so PQ needs ≥ 256 training vectors
+
+# Read-only mapping per stored structure: vector codes for flat/HNSW (faiss ≥ 1.11), inverted lists for IVF-PQ.
+# Without IO_FLAG_MMAP_IFC flat/HNSW shards (and IVF-PQ exact vectors) are read into each process.
+MMAP_CODES  = hasattr(faiss, "IO_FLAG_MMAP_IFC")
+_MMAP_IFC   = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+_MMAP_FLAGS = {"flat": _MMAP_IFC, "hnsw": _MMAP_IFC, "ivfpq": faiss.IO_FLAG_MMAP}
+
+
+def _kind_of(idx) -> str:
+    """Classify a raw faiss index as one of KINDS, or '' if unsupported."""
+    idx = faiss.downcast_index(idx)
+    if isinstance(idx, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(idx, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        sub = faiss.downcast_index(idx.index)
+        if isinstance(sub, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(sub, faiss.IndexFlat):
+            return "flat"
+    return ""
+
+
+class VectorIndex:
+    """
+    One ANN index over L2-normalised vectors with caller-assigned int64 ids.
+
+    `kind` is the configured target. IVF-PQ needs training data, so an ivfpq
+    index starts out flat and is trained + migrated in place once it holds
+    IVF_TRAIN_MIN vectors. `active` is the structure currently in use.
+
+    PQ codes alone lose too much recall, so an IVF-PQ index keeps the exact
+    vectors beside it (`exact`, a flat index by id): the codes pick
+    IVF_RERANK·k candidates and exact distances choose the k returned.
+    """
+
+    def __init__(self, dim: int, kind: str = INDEX_TYPE):
+        if kind not in KINDS:
+            print(f"WARNING: Unknown INDEX_TYPE '{kind}'. Using flat.")
+            kind = "flat"
+        self.dim      = dim
+        self.kind     = kind
+        self.active   = "hnsw" if kind == "hnsw" else "flat"
+        self.index    = self._build(self.active)
+        self.exact    = None        # ivfpq only; None for shards written before it was kept
+        self.migrated = False
+
+    # ── Construction ──
+    def _build(self, kind: str, train=None):
+        if kind == "hnsw":
+            hnsw = faiss.IndexHNSWFlat(self.dim, HNSW_M)
+            hnsw.hnsw.efConstruction = HNSW_EF_BUILD
+            return faiss.IndexIDMap2(hnsw)
+        if kind == "ivfpq":
+            n     = len(train)
+            nlist = IVF_NLIST or max(1, min(int(4 * math.sqrt(n)), n // 39))
+            quant = faiss.IndexFlatL2(self.dim)
+            ivf   = faiss.IndexIVFPQ(quant, self.dim, nlist, PQ_M, PQ_NBITS)
+            ivf.train(train)
+            # Hashtable direct map keeps reconstruct() and remove_ids() working by id
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+            return ivf
+        return faiss.IndexIDMap(faiss.IndexFlatL2(self.dim))
+
+    @classmethod
+    def from_faiss(cls, loaded, kind: str = INDEX_TYPE, exact=None):
+        """
+        Wrap an index read from disk, with the exact vectors of an IVF-PQ
+        one. Returns None for formats without ids. If the stored structure
+        differs from the configured kind, the vectors are migrated into the
+        new structure — no re-upload needed.
+        """
+        found = _kind_of(loaded)
+        if not found:
+            return None
+        vi = cls(loaded.d, kind)
+        vi.index, vi.active = loaded, found
+        vi.exact = exact if found == "ivfpq" else None
+        target = vi._target()
+        if target != found:
+            print(f"Migrating vector index: {found} → {target} ({loaded.ntotal} vectors)")
+            vi._rebuild(target)
+            vi.migrated = True
+        return vi
+
+    def _target(self) -> str:
+        if self.kind == "ivfpq" and self.ntotal < max(IVF_TRAIN_MIN, 1 << PQ_NBITS):
+            # Not enough data to train yet; an existing trained index is kept
+            return "ivfpq" if self.active == "ivfpq" else "flat"
+        return self.kind
+
+    def export(self):
+        """
+        Return (vectors, ids) for everything stored. An IVF-PQ index without
+        exact vectors can only give decoded approximations.
+        """
+        n = self.ntotal
+        if n == 0:
+            return np.zeros((0, self.dim), dtype="float32"), np.zeros(0, dtype="int64")
+        if self.exact is not None:
+            return self.exact.index.reconstruct_n(0, n), faiss.vector_to_array(self.exact.id_map).astype("int64")
+        if self.active == "ivfpq":
+            ids = []
+            inv = self.index.invlists
+            for lst in range(inv.nlist):
+                size = inv.list_size(lst)
+                if size:
+                    ids.append(faiss.rev_swig_ptr(inv.get_ids(lst), size).copy())
+            ids  = np.concatenate(ids).astype("int64")
+            vecs = np.vstack([self.index.reconstruct(int(i)) for i in ids]).astype("float32")
+            return vecs, ids
+        ids  = faiss.vector_to_array(self.index.id_map).astype("int64")
+        vecs = self.index.index.reconstruct_n(0, n)
+        return vecs, ids
+
+    def _rebuild(self, kind: str, drop=None):
+        vecs, ids = self.export()
+        if drop is not None and len(ids):
+            keep      = ~np.isin(ids, drop)
+            vecs, ids = vecs[keep], ids[keep]
+        self.index  = self._build(kind, train=vecs) if kind == "ivfpq" else self._build(kind)
+        self.exact  = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim)) if kind == "ivfpq" else None
+        self.active = kind
+        if len(ids):
+            vecs = np.ascontiguousarray(vecs)
+            self.index.add_with_ids(vecs, ids)
+            if self.exact is not None:
+                self.exact.add_with_ids(vecs, ids)
+
+    # ── Mutation ──
+    def add(self, vecs, ids):
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        ids  = np.asarray(ids, dtype="int64")
+        self.index.add_with_ids(vecs, ids)
+        if self.exact is not None:
+            self.exact.add_with_ids(vecs, ids)
+        target = self._target()
+        if target != self.active:
+            print(f"Training {target} index on {self.ntotal} vectors")
+            self._rebuild(target)
+
+    def remove(self, ids) -> int:
+        ids = np.asarray(ids, dtype="int64")
+        if not len(ids):
+            return 0
+        if self.active == "hnsw":
+            # HNSW graphs cannot delete nodes; rebuild from the surviving vectors
+            before = self.ntotal
+            self._rebuild("hnsw", drop=ids)
+            return before - self.ntotal
+        if self.active == "ivfpq":
+            if self.exact is not None:
+                self.exact.remove_ids(faiss.IDSelectorBatch(ids))
+            # The hashtable direct map only supports removal by explicit id array
+            return self.index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+        return self.index.remove_ids(faiss.IDSelectorBatch(ids))
+
+    # ── Search ──
+    def search(self, q_vecs, k: int):
+        q_vecs = np.ascontiguousarray(q_vecs, dtype="float32")
+        if self.active == "ivfpq":
+            self.index.nprobe = IVF_NPROBE
+            if self.exact is not None and IVF_RERANK > 1:
+                return self._rerank(q_vecs, *self.index.search(q_vecs, min(k * IVF_RERANK, self.ntotal)), k)
+        elif self.active == "hnsw":
+            faiss.downcast_index(self.index.index).hnsw.efSearch = max(HNSW_EF_SEARCH, k)
+        return self.index.search(q_vecs, k)
+
+    def _rerank(self, q_vecs, _, cand, k: int):
+        """Exact L2 distances to each query's candidates, nearest k first, padded like faiss."""
+        dists = np.full((len(q_vecs), k), np.inf, dtype="float32")
+        ids   = np.full((len(q_vecs), k), -1, dtype="int64")
+        for row, (q, c) in enumerate(zip(q_vecs, cand)):
+            c = c[c >= 0]
+            if not len(c):
+                continue
+            d     = ((self.exact.reconstruct_batch(c) - q) ** 2).sum(axis=1)
+            order = np.argsort(d, kind="stable")[:k]
+            dists[row, :len(order)] = d[order]
+            ids[row, :len(order)]   = c[order]
+        return dists, ids
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def clone(self):
+        """Independent copy to mutate while searches continue on this one."""
+        vi = VectorIndex.__new__(VectorIndex)
+        vi.__dict__.update(self.__dict__)
+        vi.index = faiss.clone_index(self.index)
+        vi.exact = None if self.exact is None else faiss.clone_index(self.exact)
+        return vi
+
+    def write(self, path):
+        """The index to `path`; an IVF-PQ index's exact vectors to exact_path(path)."""
+        faiss.write_index(self.index, str(path))
+        if self.exact is not None:
+            faiss.write_index(self.exact, str(exact_path(path)))
+
+
+def exact_path(path) -> Path:
+    """Where the exact vectors of the IVF-PQ shard at `path` are kept."""
+    path = Path(path)
+    return path.with_name(path.stem + ".exact.faiss")
+
+
+# ── Sharding ──
+def shard_key(machine: str, source: str) -> tuple:
+    """Shard for one machine's manuals or repair logs. Machine match is case-insensitive."""
+    return (machine.strip().lower(), "repair_log" if source == "repair_log" else "manual")
+
+
+def _shard_file(key: tuple) -> str:
+    return hashlib.sha1(f"{key[0]}\0{key[1]}".encode()).hexdigest()[:16] + ".faiss"
+
+
+class ShardedIndex:
+    """
+    One VectorIndex per (machine, source) shard. Queries name the shards they
+    need, so search cost follows that machine's data instead of the whole
+    plant's. Only shards touched since the last write are rewritten.
+
+    fork() gives a copy-on-write version: it shares every shard with its
+    parent and copies one only when it first changes it.
+    """
+
+    MANIFEST = "shards.json"
+
+    def __init__(self, dim: int, kind: str = INDEX_TYPE):
+        self.dim    = dim
+        self.kind   = kind
+        self.shards = {}
+        self.dirty  = set()
+        self.owned  = set()     # shards not shared with another version
+
+    @property
+    def ntotal(self) -> int:
+        return sum(s.ntotal for s in self.shards.values())
+
+    def keys(self, source: str = None) -> list:
+        return [k for k in self.shards if source is None or k[1] == source]
+
+    # ── Versions ──
+    def fork(self):
+        """A version that can be changed without affecting this one, which may still be searched."""
+        si        = ShardedIndex(self.dim, self.kind)
+        si.shards = dict(self.shards)
+        si.dirty  = set(self.dirty)
+        return si
+
+    def _own(self, key: tuple) -> VectorIndex:
+        shard = self.shards[key]
+        if key not in self.owned:
+            shard = self.shards[key] = shard.clone()
+            self.owned.add(key)
+        return shard
+
+    # ── Mutation ──
+    def add(self, vecs, ids, keys):
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        ids  = np.asarray(ids, dtype="int64")
+        for key, rows in _group(keys).items():
+            if key not in self.shards:
+                self.shards[key] = VectorIndex(self.dim, self.kind)
+                self.owned.add(key)
+            self._own(key).add(vecs[rows], ids[rows])
+            self.dirty.add(key)
+
+    def remove(self, ids, keys) -> int:
+        ids     = np.asarray(ids, dtype="int64")
+        removed = 0
+        for key, rows in _group(keys).items():
+            if key not in self.shards:
+                continue
+            shard    = self._own(key)
+            removed += shard.remove(ids[rows])
+            self.dirty.add(key)
+            if shard.ntotal == 0:
+                del self.shards[key]
+        return removed
+
+    # ── Search ──
+    def search(self, q_vecs, k: int, keys):
+        """
+        Search only the given shards and merge to the k nearest per query.
+        Returns faiss-style (distances, ids) padded with inf / -1.
+        """
+        q_vecs = np.ascontiguousarray(q_vecs, dtype="float32")
+        dists, ids = [], []
+        for key in keys:
+            shard = self.shards.get(key)
+            if shard is None or shard.ntotal == 0:
+                continue
+            d, i = shard.search(q_vecs, min(k, shard.ntotal))
+            dists.append(d)
+            ids.append(i)
+        nq = len(q_vecs)
+        if not dists:
+            return np.full((nq, 0), np.inf, dtype="float32"), np.full((nq, 0), -1, dtype="int64")
+        dists = np.hstack(dists)
+        ids   = np.hstack(ids)
+        dists[ids < 0] = np.inf
+        order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(dists, order, 1), np.take_along_axis(ids, order, 1)
+
+    # ── Persistence ──
+    def write(self, directory: Path, base: Path = None):
+        """
+        Rewrite dirty shards, then the manifest; unreferenced shard files are
+        removed. With `base`, clean shards are hard-linked from that directory
+        instead of being serialised again.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        for key, shard in self.shards.items():
+            dest  = directory / _shard_file(key)
+            files = [dest, exact_path(dest)] if shard.exact is not None else [dest]
+            if key not in self.dirty:
+                if all(f.exists() for f in files):
+                    continue
+                if base is not None and all(_link(base / f.name, f) for f in files):
+                    continue
+            shard.write(dest)
+        self.dirty.clear()
+
+        manifest = [
+            dict({"machine": k[0], "source": k[1], "file": _shard_file(k), "type": s.active},
+                 **({"exact": exact_path(_shard_file(k)).name} if s.exact is not None else {}))
+            for k, s in self.shards.items()
+        ]
+        tmp = directory / (self.MANIFEST + ".tmp")
+        tmp.write_text(json.dumps({"dim": self.dim, "shards": manifest}, indent=1))
+        os.replace(tmp, directory / self.MANIFEST)
+
+        live = {m["file"] for m in manifest} | {m["exact"] for m in manifest if "exact" in m}
+        for f in directory.glob("*.faiss"):
+            if f.name not in live:
+                f.unlink(missing_ok=True)
+
+    @classmethod
+    def read(cls, directory: Path, kind: str = INDEX_TYPE, mmap: bool = False):
+        """
+        With mmap, shard files are mapped read-only instead of copied into
+        memory — processes serving the same files share one copy in the page
+        cache. Such an index must not be modified, and is never migrated.
+        """
+        data = json.loads((directory / cls.MANIFEST).read_text())
+        si   = cls(data.get("dim", 0), kind)
+        for entry in data["shards"]:
+            key   = (entry["machine"], entry["source"])
+            path  = str(directory / entry["file"])
+            exact = str(directory / entry["exact"]) if "exact" in entry else None
+            if mmap:
+                found = entry.get("type", "flat")
+                exact = exact and faiss.read_index(exact, _MMAP_FLAGS["flat"])
+                shard = VectorIndex.from_faiss(faiss.read_index(path, _MMAP_FLAGS[found]), found, exact)
+            else:
+                exact = exact and faiss.read_index(exact)
+                shard = VectorIndex.from_faiss(faiss.read_index(path), kind, exact)
+            if shard is None:
+                continue
+            si.dim = shard.dim
+            si.shards[key] = shard
+            si.owned.add(key)
+            if shard.migrated:
+                si.dirty.add(key)
+        return si
+
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        return (directory / cls.MANIFEST).exists()
+
+    @classmethod
+    def from_single(cls, single: VectorIndex, metadata: dict, kind: str = INDEX_TYPE):
+        """Split one global index into shards using each vector's metadata."""
+        si        = cls(single.dim, kind)
+        vecs, ids = single.export()
+        keep      = [j for j, vid in enumerate(ids) if int(vid) in metadata]
+        if keep:
+            keys = [
+                shard_key(metadata[int(ids[j])].get("machine_name", ""),
+                          metadata[int(ids[j])].get("source", "manual"))
+                for j in keep
+            ]
+            si.add(vecs[keep], ids[keep], keys)
+        return si
+
+
+def _link(src: Path, dest: Path) -> bool:
+    try:
+        os.link(src, dest)
+        return True
+    except OSError:
+        return False
+
+
+def _group(keys) -> dict:
+    """Map each distinct key to the row positions that carry it."""
+    rows = {}
+    for j, key in enumerate(keys):
+        rows.setdefault(key, []).append(j)
+    return rows
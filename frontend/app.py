@@ -4,9 +4,18 @@ IndustrialRAG - Streamlit Frontend
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import time
+import json
+import html
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-API_BASE = os.environ.get("API_BASE", "http://localhost:8000")
+API_BASE     = os.environ.get("API_BASE", "http://localhost:8000")
+HTTP_POOL    = int(os.environ.get("HTTP_POOL", "16"))        # keep-alive connections to the backend
+SIDEBAR_TTL  = float(os.environ.get("SIDEBAR_TTL", "10"))    # seconds status, machines and stats are reused for
+RESULTS_KEPT = int(os.environ.get("RESULTS_KEPT", "20"))     # diagnoses kept per browser session
+FORMAT_CONC  = int(os.environ.get("FORMAT_CONCURRENCY", "4"))  # parallel /format calls when /format/batch is unavailable
 
 st.set_page_config(
     page_title="IndustrialRAG",
@@ -41,6 +50,9 @@ h1, h2, h3                  { font-family: 'IBM Plex Mono', monospace; color: #f
 .badge        { display:inline-block; background:#1e2a4a; border:1px solid #4f8ef7; color:#7ba8f7;
                 padding:3px 12px; border-radius:2px; font-family:'IBM Plex Mono',monospace;
                 font-size:0.75rem; letter-spacing:1px; text-transform:uppercase; margin-bottom:12px; }
+.stream-box   { background:#13161f; border:1px solid #1e2235; border-radius:4px; padding:14px 18px;
+                font-family:'IBM Plex Mono',monospace; font-size:0.82rem; color:#c0c8e0;
+                white-space:pre-wrap; line-height:1.5; }
 .chunk-row    { border-left:3px solid; padding:8px 12px; margin:5px 0; background:#0d0f14;
                 font-size:0.8rem; border-radius:2px; }
 
@@ -68,9 +80,21 @@ hr { border-color:#1e2235; }
 
 # ── API helpers ──────────────────────────────────────────────────────────────
 
+@st.cache_resource
+def http_session() -> requests.Session:
+    """One keep-alive connection pool for every browser session and rerun."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+HTTP = http_session()
+
+
 def api_get(path: str):
     try:
-        r = requests.get(f"{API_BASE}{path}", timeout=20)
+        r = HTTP.get(f"{API_BASE}{path}", timeout=20)
         if r.status_code == 200:
             return r.json()
     except Exception:
@@ -80,7 +104,7 @@ def api_get(path: str):
 
 def api_post(path: str, json=None, data=None, files=None):
     try:
-        r = requests.post(
+        r = HTTP.post(
             f"{API_BASE}{path}",
             json=json, data=data, files=files,
             timeout=180,
@@ -92,9 +116,18 @@ def api_post(path: str, json=None, data=None, files=None):
         return {"error": str(e)}
 
 
+def api_stream(path: str, payload: dict):
+    """Yield NDJSON events from a streaming endpoint. Raises on connection or HTTP errors."""
+    with HTTP.post(f"{API_BASE}{path}", json=payload, stream=True, timeout=180) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
 def api_delete(path: str):
     try:
-        r = requests.delete(f"{API_BASE}{path}", timeout=30)
+        r = HTTP.delete(f"{API_BASE}{path}", timeout=30)
         if r.status_code == 200:
             return r.json()
         return {"error": f"HTTP {r.status_code}: {r.text[:400]}"}
@@ -102,6 +135,72 @@ def api_delete(path: str):
         return {"error": str(e)}
 
 
+class Unreachable(Exception):
+    pass
+
+
+@st.cache_data(ttl=SIDEBAR_TTL, show_spinner=False)
+def _cached_get(path: str):
+    out = api_get(path)
+    if out is None:
+        raise Unreachable(path)     # exceptions are not cached: the next rerun asks again
+    return out
+
+
+def cached_get(path: str):
+    """api_get for what every rerun shows: status, machines, stats. None while the backend is unreachable."""
+    try:
+        return _cached_get(path)
+    except Unreachable:
+        return None
+
+
+def kb_changed():
+    """After an upload, delete or reset: refetch sidebar data, drop answers built on the old index."""
+    _cached_get.clear()
+    st.session_state.pop("answers", None)
+    st.session_state.pop("shown", None)
+
+
+def session_answers() -> dict:
+    """
+    This session's kept diagnoses. Dropped as soon as /admin/stats reports a
+    new kb_version, so a change made from any session or process is noticed.
+    """
+    kb = (cached_get("/admin/stats") or {}).get("kb_version")
+    if kb is not None and st.session_state.get("answers_kb") != kb:
+        st.session_state["answers_kb"] = kb
+        st.session_state.pop("answers", None)
+        st.session_state.pop("shown", None)
+    return st.session_state.setdefault("answers", {})
+
+
+def wait_for_job(job_id: str) -> dict:
+    """Poll an ingestion job until it settles, showing live progress. Returns the final job."""
+    bar = st.progress(0.0, text="Queued...")
+    while True:
+        job = api_get(f"/admin/jobs/{job_id}")
+        if not job:
+            bar.empty()
+            return {"status": "failed", "error": "Backend unreachable while waiting for upload"}
+        if job["status"] in ("done", "failed", "cancelled"):
+            bar.empty()
+            return job
+        eta = f" · ETA {job['eta_s']:.0f}s" if job.get("eta_s") is not None else ""
+        # Pages are read and embedded at the same time
+        if job.get("pages_total") and job["pages_done"] < job["pages_total"]:
+            frac = 0.9 * job["pages_done"] / job["pages_total"]
+            text = (f"Reading page {job['pages_done']}/{job['pages_total']} · "
+                    f"{job['chunks_embedded']} chunks embedded · {job['pages_per_s']:.1f} pages/s{eta}")
+        elif job.get("chunks_total"):
+            frac = 0.9 + 0.1 * job["chunks_embedded"] / max(job["chunks_total"], 1)
+            text = f"Embedding {job['chunks_embedded']}/{job['chunks_total']} chunks{eta}"
+        else:
+            frac, text = 0.0, "Queued..."
+        bar.progress(min(frac, 1.0), text=text)
+        time.sleep(1)
+
+
 # ── LLM output parser ────────────────────────────────────────────────────────
 
 def parse_output(text: str) -> dict:
@@ -141,7 +240,54 @@ def parse_output(text: str) -> dict:
 
 # ── Result renderer ──────────────────────────────────────────────────────────
 
-def render_result(res: dict):
+def stream_format(payload: dict) -> dict:
+    """
+    Show the answer token by token while it is generated, then return it like
+    /format does. Falls back to the blocking endpoint if streaming fails.
+    """
+    live, text, done = st.empty(), "", None
+    try:
+        for ev in api_stream("/format/stream", payload):
+            if ev["type"] == "token":
+                text += ev["text"]
+                live.markdown(f'<div class="stream-box">{html.escape(text)}▌</div>', unsafe_allow_html=True)
+            elif ev["type"] == "reset":
+                text = ""
+            elif ev["type"] == "done":
+                done = ev
+    except Exception:
+        done = None
+    live.empty()
+    if done is None:
+        return api_post("/format", json=payload)
+    st.caption(f"first token {done['ttft_ms']} ms · {done['total_ms'] / 1000:.1f} s total · {done['backend']}")
+    return done
+
+def format_many(results: list):
+    """
+    Yield (index, fmt) for each result as its answer completes, generated
+    concurrently by /format/batch. Whatever the batch call did not deliver is
+    retried on /format, FORMAT_CONCURRENCY calls at a time.
+    """
+    payloads = [{"context": r.get("context", ""), "query": r.get("query", ""),
+                 "machine": r.get("machine", "Unknown")} for r in results]
+    pending  = set(range(len(payloads)))
+    try:
+        for ev in api_stream("/format/batch", {"items": payloads}):
+            if ev["type"] == "result" and ev["index"] in pending:
+                pending.discard(ev["index"])
+                yield ev["index"], ev
+    except Exception:
+        pass
+    if not pending:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(pending), FORMAT_CONC)) as pool:
+        futures = {pool.submit(api_post, "/format", json=payloads[i]): i for i in pending}
+        for fut in as_completed(futures):
+            yield futures[fut], fut.result()
+
+def render_result(res: dict, fmt: dict = None) -> dict:
+    """Render one machine's card; fmt is its /format answer, streamed here if not given. Returns fmt."""
     machine    = res.get("machine", "Unknown")
     query      = res.get("query", "")
     context    = res.get("context", "")
@@ -150,7 +296,8 @@ def render_result(res: dict):
 
     st.markdown(f'<div class="badge">⚙️ {machine}</div>', unsafe_allow_html=True)
 
-    fmt = api_post("/format", json={"context": context, "query": query, "machine": machine})
+    if fmt is None:
+        fmt = stream_format({"context": context, "query": query, "machine": machine})
 
     if not fmt or "error" in fmt or not fmt.get("formatted"):
         err = (fmt or {}).get("error", "Format endpoint unreachable")
@@ -159,7 +306,7 @@ def render_result(res: dict):
             with st.expander("Raw retrieved context"):
                 st.text(context[:4000])
         st.markdown("---")
-        return
+        return fmt
 
     parsed = parse_output(fmt["formatted"])
 
@@ -226,6 +373,45 @@ def render_result(res: dict):
             st.text(context[:3000])
 
     st.markdown("---")
+    return fmt
+
+
+def show_diagnosis(entry: dict):
+    """
+    Render a diagnosis kept in session state. Answers already generated are
+    reused, so reruns cost no backend calls; only missing or failed ones are
+    formatted, and successful ones are stored back into the entry.
+    """
+    results, formats = entry["results"], entry["formats"]
+    if not results:
+        st.warning(
+            "No relevant content found above the threshold. "
+            "Try rephrasing, or check the correct manual is uploaded."
+        )
+        return
+
+    def keep(i, fmt):
+        if fmt and "error" not in fmt and fmt.get("formatted"):
+            formats[i] = fmt
+
+    st.markdown(f"### Results — *{entry['query']}*")
+    missing = [i for i in range(len(results)) if i not in formats]
+    if len(results) == 1 and missing:
+        keep(0, render_result(results[0]))
+        return
+    # All machines generate at once; each card fills in as its answer lands
+    slots = [st.empty() for _ in results]
+    for i, slot in enumerate(slots):
+        if i in formats:
+            with slot.container():
+                render_result(results[i], formats[i])
+        else:
+            slot.info(f"⚙️ {results[i].get('machine', 'Unknown')} — generating answer...")
+    if missing:
+        for n, fmt in format_many([results[i] for i in missing]):
+            i = missing[n]
+            with slots[i].container():
+                keep(i, render_result(results[i], fmt))
 
 
 # ── Sidebar ──────────────────────────────────────────────────────────────────
@@ -239,12 +425,14 @@ with st.sidebar:
         unsafe_allow_html=True,
     )
 
-    health = api_get("/health")
+    health = cached_get("/health")
     if health:
+        # /health answers before the index and model have finished loading
+        colour, status = ("#22c55e", "● ONLINE") if health.get("ready", True) else ("#f59e0b", "● STARTING — loading index")
         st.markdown(
             f'<div class="metric-card">'
             f'<div style="font-size:0.7rem;color:#5a6380;text-transform:uppercase;letter-spacing:2px">System Status</div>'
-            f'<div style="color:#22c55e;font-family:IBM Plex Mono,monospace;margin-top:4px">● ONLINE</div>'
+            f'<div style="color:{colour};font-family:IBM Plex Mono,monospace;margin-top:4px">{status}</div>'
             f'<div style="color:#5a6380;font-size:0.78rem;margin-top:4px">{health.get("chunks_indexed", 0)} chunks indexed</div>'
             f"</div>",
             unsafe_allow_html=True,
@@ -261,7 +449,7 @@ with st.sidebar:
 
     st.markdown("---")
 
-    machines_resp = api_get("/admin/machines")
+    machines_resp = cached_get("/admin/machines")
     machines = (machines_resp or {}).get("machines", [])
 
     if machines:
@@ -315,23 +503,25 @@ with tab_query:
         elif not machines:
             st.error("No machines indexed. Upload manuals via the Admin tab first.")
         else:
-            mf = "all" if sel_machine == "All Machines" else sel_machine
-            with st.spinner("Searching knowledge base..."):
-                resp = api_post("/query", json={"query": query_text, "machine_name": mf})
-
-            if "error" in resp:
-                st.error(f"Query failed: {resp['error']}")
-            else:
-                results = resp.get("results", [])
-                if not results:
-                    st.warning(
-                        "No relevant content found above the threshold. "
-                        "Try rephrasing, or check the correct manual is uploaded."
-                    )
+            mf      = "all" if sel_machine == "All Machines" else sel_machine
+            key     = f"{mf}\0{query_text.strip()}"
+            answers = session_answers()
+            if key not in answers:
+                with st.spinner("Searching knowledge base..."):
+                    resp = api_post("/query", json={"query": query_text, "machine_name": mf})
+                if "error" in resp:
+                    st.error(f"Query failed: {resp['error']}")
                 else:
-                    st.markdown(f"### Results — *{query_text}*")
-                    for res in results:
-                        render_result(res)
+                    answers[key] = {"query": query_text, "results": resp.get("results", []), "formats": {}}
+                    while len(answers) > RESULTS_KEPT:
+                        answers.pop(next(iter(answers)))
+            if key in answers:
+                st.session_state["shown"] = key
+
+    # Kept across reruns: widget clicks elsewhere don't re-query or re-generate
+    shown = session_answers().get(st.session_state.get("shown"))
+    if shown:
+        show_diagnosis(shown)
 
 
 # ── ADMIN ────────────────────────────────────────────────────────────────────
@@ -352,22 +542,22 @@ with tab_admin:
             elif pdf_file is None:
                 st.error("Select a PDF file.")
             else:
-                with st.spinner("Parsing and indexing PDF..."):
-                    r = requests.post(
-                        f"{API_BASE}/admin/upload/pdf",
-                        data={"machine_name": pdf_machine.strip()},
-                        files={"file": (pdf_file.name, pdf_file.getvalue(), "application/pdf")},
-                        timeout=180,
-                    )
-                if r.status_code == 200:
-                    d   = r.json()
+                r = api_post(
+                    "/admin/upload/pdf",
+                    data={"machine_name": pdf_machine.strip()},
+                    files={"file": (pdf_file.name, pdf_file.getvalue(), "application/pdf")},
+                )
+                job = wait_for_job(r["job_id"]) if "job_id" in r else {"status": "failed", **r}
+                if job["status"] == "done":
+                    d   = job["result"]
                     msg = f"✓ Indexed {d['chunks_stored']} chunks from **{d['filename']}**"
                     if d.get("old_chunks_replaced"):
                         msg += f" (replaced {d['old_chunks_replaced']} old chunks)"
                     st.success(msg)
+                    kb_changed()
                     st.rerun()
                 else:
-                    st.error(f"Upload failed: {r.text}")
+                    st.error(f"Upload {job['status']}: {job.get('error')}")
 
     # Upload Excel
     with col_xls:
@@ -380,25 +570,62 @@ with tab_admin:
             elif xls_file is None:
                 st.error("Select a file.")
             else:
-                with st.spinner("Parsing and indexing..."):
-                    r = requests.post(
-                        f"{API_BASE}/admin/upload/excel",
-                        data={"machine_name": xls_machine.strip()},
-                        files={"file": (xls_file.name, xls_file.getvalue())},
-                        timeout=60,
-                    )
-                if r.status_code == 200:
-                    d = r.json()
+                r = api_post(
+                    "/admin/upload/excel",
+                    data={"machine_name": xls_machine.strip()},
+                    files={"file": (xls_file.name, xls_file.getvalue())},
+                )
+                job = wait_for_job(r["job_id"]) if "job_id" in r else {"status": "failed", **r}
+                if job["status"] == "done":
+                    d = job["result"]
                     st.success(f"✓ Indexed {d['rows_stored']} rows from **{d['filename']}**")
+                    kb_changed()
                     st.rerun()
                 else:
-                    st.error(f"Upload failed: {r.text}")
+                    st.error(f"Upload {job['status']}: {job.get('error')}")
+
+    # Bulk import
+    st.markdown("### 📦 Bulk Import")
+    st.markdown(
+        '<div style="color:#5a6380;font-size:0.82rem;margin-bottom:8px">'
+        "Many PDFs and logs at once, or a .zip with one folder per machine "
+        "(e.g. <code>Pioneer 3/manual.pdf</code>). Loose files go to the machine named here."
+        "</div>",
+        unsafe_allow_html=True,
+    )
+    bulk_machine = st.text_input("Machine Name (for loose files)", placeholder="e.g. Pioneer 3", key="k_bulk_machine")
+    bulk_files   = st.file_uploader(
+        "Select Files", type=["pdf", "xlsx", "xls", "csv", "zip"], accept_multiple_files=True, key="k_bulk_files",
+    )
+    if st.button("Import All", key="k_btn_bulk"):
+        if not bulk_files:
+            st.error("Select at least one file.")
+        else:
+            r = api_post(
+                "/admin/upload/bulk",
+                data={"machine_name": bulk_machine.strip()},
+                files=[("files", (f.name, f.getvalue())) for f in bulk_files],
+            )
+            job = wait_for_job(r["job_id"]) if "job_id" in r else {"status": "failed", **r}
+            if job["status"] == "done":
+                d = job["result"]
+                st.success(
+                    f"✓ {d['files']} files: {d['indexed']} indexed, {d['unchanged']} unchanged, "
+                    f"{d['failed']} failed · {d['chunks_stored']} chunks · "
+                    f"{d['pages']} pages at {d['pages_per_s']:.1f} pages/s"
+                )
+                for f in d["details"]:
+                    if f["status"] in ("failed", "skipped"):
+                        st.warning(f"{f.get('filename') or f.get('file')}: {f['status']} — {f.get('error')}")
+                kb_changed()
+            else:
+                st.error(f"Import {job['status']}: {job.get('error')}")
 
     st.markdown("---")
 
     # Knowledge base status
     st.markdown("### 📋 Current Knowledge Base")
-    stats = api_get("/admin/stats")
+    stats = cached_get("/admin/stats")
     if stats:
         m1, m2, m3 = st.columns(3)
         m1.metric("Total Chunks", stats.get("total_chunks", 0))
@@ -442,6 +669,7 @@ with tab_admin:
                                     f"Deleted {f['filename']} "
                                     f"({dr.get('chunks_removed', 0)} chunks removed)"
                                 )
+                                kb_changed()
                             del st.session_state[f"confirm_{f['filename']}"]
                             st.rerun()
                     with no:
@@ -475,6 +703,7 @@ with tab_admin:
                     st.error(dr["error"])
                 else:
                     st.success("Knowledge base reset complete.")
+                    kb_changed()
                 del st.session_state["confirm_reset"]
                 st.rerun()
         with rc2:
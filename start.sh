@@ -10,6 +10,16 @@ export OLLAMA_MODEL="mistral"      # change to llama3, gemma2, etc.
 # export OPENAI_API_KEY="sk-..."
 # export ANTHROPIC_API_KEY="sk-ant-..."
 
+# ── Vector index ─────────────────────────────────────────
+export INDEX_TYPE="flat"           # flat | hnsw | ivfpq (see README → Tuning)
+
+# ── Embeddings ───────────────────────────────────────────
+export EMBED_ENGINE="torch"        # torch | torch-int8 | onnx | onnx-int8 (see README → Tuning)
+
+# ── Startup ──────────────────────────────────────────────
+export LAZY_STARTUP="true"         # load index + model in the background; "false" = before serving
+SERVE_WORKERS="${SERVE_WORKERS:-1}" # >1: one writer + this many query workers sharing a memory-mapped index
+
 # ── Shared config ────────────────────────────────────────
 export API_BASE="http://localhost:8000"
 
@@ -17,17 +27,34 @@ echo "⚙️  IndustrialRAG starting..."
 echo ""
 
 # ── Backend ──────────────────────────────────────────────
-echo "Starting backend on :8000"
 cd "$SCRIPT_DIR/backend"
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload &
-BACKEND_PID=$!
+WRITER_PID=""
+if [ "$SERVE_WORKERS" -gt 1 ]; then
+    # Writer owns ingestion and the index files; it must be up before the readers map them
+    echo "Starting index writer on :8010"
+    ROLE=writer uvicorn main:app --host 127.0.0.1 --port 8010 &
+    WRITER_PID=$!
+    for i in $(seq 1 120); do
+        curl -sf http://127.0.0.1:8010/ready > /dev/null 2>&1 && break
+        sleep 1
+    done
+    echo "Starting $SERVE_WORKERS query workers on :8000"
+    ROLE=reader WRITER_URL="http://127.0.0.1:8010" \
+        uvicorn main:app --host 0.0.0.0 --port 8000 --workers "$SERVE_WORKERS" &
+    BACKEND_PID=$!
+else
+    echo "Starting backend on :8000"
+    uvicorn main:app --host 0.0.0.0 --port 8000 --reload &
+    BACKEND_PID=$!
+fi
 
-# Wait for backend to be ready
+# Wait for the API to come up. The index and embedding model finish loading in
+# the background (GET /ready); requests that need them wait for them.
 echo "Waiting for backend..."
 for i in $(seq 1 15); do
     sleep 1
     if curl -sf http://localhost:8000/health > /dev/null 2>&1; then
-        echo "Backend ready."
+        echo "Backend up (index/model warming up: curl localhost:8000/ready)."
         break
     fi
     if [ $i -eq 15 ]; then
@@ -56,6 +83,6 @@ echo "  Ctrl+C to stop"
 echo ""
 
 # Trap Ctrl+C and kill both
-trap "echo 'Stopping...'; kill $BACKEND_PID $FRONTEND_PID 2>/dev/null; exit 0" SIGINT SIGTERM
+trap "echo 'Stopping...'; kill $BACKEND_PID $WRITER_PID $FRONTEND_PID 2>/dev/null; exit 0" SIGINT SIGTERM
 
 wait $BACKEND_PID $FRONTEND_PID